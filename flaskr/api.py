@@ -11,57 +11,507 @@ Call this api passing a version of api and "students" or "courses" table.
         /api/v1/courses/med/
         where "med" is course_name
 
+    Collections are paginated with a keyset cursor:
+        /api/v1/students/?limit=100
+        /api/v1/students/?limit=100&after=<token>
+        where <token> is taken from the "X-Next-Cursor" response header
+        (or the "Link: rel=next" header) of the previous page
+
+    Collections can be searched by columns, text columns are matched with
+    "match" mode: exact (default), prefix, contains or fuzzy:
+        /api/v1/students/?last_name=smi&match=prefix
+        /api/v1/courses/?description=mathematcs&match=fuzzy
+    Fuzzy results are ranked by similarity and not paginated
+
+    GET responses carry ETag and Last-Modified headers built from
+    table versions (counts of logged changes) and row versions. Requests
+    with a matching If-None-Match (or not older If-Modified-Since) get
+    304 Not Modified
+
+    Full students dump is streamed as NDJSON (one JSON object per line):
+        /api/v1/students/?stream=1
+        or any request with "Accept: application/x-ndjson" header
+
+    Enrollments are reached from both sides:
+        /api/v1/students/420/courses/
+        /api/v1/students/420/courses/med/
+        /api/v1/courses/med/students/?limit=100
+        /api/v1/courses/med/students/420/
+    GET of an item route returns that one enrollment, 404 if there is
+    none. POST/DELETE to the collections take {"course_names": [...]} or
+    {"student_ids": [...]} and are applied with a single statement
+
+    Number of students per group, optionally filtered by size:
+        /api/v1/groups/sizes/?min_size=10&max_size=20
+
+    Number of students of every course or of one course, read from
+    counters kept by triggers instead of counting enrollments:
+        /api/v1/enrollments/
+        /api/v1/enrollments/med/
+
     To extract OpenAPI-Specification go to:
     swagger/
+    Flasgger docs generated from docstrings are served at apidocs/ only
+    when FLASGGER config is set, or written by an explicit CLI step:
+        python app.py apispec -o apispec.json
 
     Classes:
         Students:
             Handles GET, POST, PUT, DELETE request for students table
         Courses:
             Handles GET, POST, PUT, DELETE request for courses table
+        GroupSizes:
+            Handles GET request for number of students per group
+        CourseEnrollments:
+            Handles GET request for number of students of courses
+        StudentCourses:
+            Handles GET, POST, DELETE request for courses of a student
+        CourseStudents:
+            Handles GET, POST, DELETE request for students of a course
 """
 
-from flask import jsonify, make_response
+import json
+import zlib
+from itertools import islice
+import click
+from flask import current_app, jsonify, make_response, url_for, Response, \
+    stream_with_context
 from flask_restful import Resource, Api, abort
+from sqlalchemy import insert, select, delete, func, text, true
+from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from flasgger import Swagger
-from app import Student, Course, app, db, request
-from flask_swagger_ui import get_swaggerui_blueprint
+from itsdangerous import URLSafeSerializer, BadSignature
+from app import Student, Course, StudentCourse, CourseEnrollmentCount, \
+    db, request, table_version_query, table_version_source, \
+    search_conditions, MATCH_MODES, STUDENTS_TEXT_FIELDS, \
+    COURSES_TEXT_FIELDS, reference_cache, cached_course, cached_group_sizes
+from metrics import query_budget
+
+
+api = Api()
+
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 1000
+STREAM_BATCH_SIZE = 1000
+NDJSON_MIMETYPE = 'application/x-ndjson'
+INSERT_CHUNK_SIZE = 1000
+CURSOR_SALT = 'api-page-cursor'
+
+# Columns served by collection pages and streams, api_async.py uses them too
+STUDENT_COLUMNS = (Student.student_id, Student.first_name,
+                   Student.last_name, Student.group_id)
+COURSE_COLUMNS = (Course.course_name, Course.description)
+
+
+def cursor_serializer(secret_key=None):
+    """Return serializer of page cursors, signed with app's SECRET_KEY"""
+
+    return URLSafeSerializer(secret_key or current_app.config['SECRET_KEY'],
+                             salt=CURSOR_SALT)
+
+
+def page_args(endpoint, args=None, serializer=None):
+    """Return (limit, after) parsed from the query string args (of the
+    current request by default). limit is clamped to PAGE_SIZE_MAX, after
+    is the decoded keyset value of the last row of the previous page or
+    None for the first page
+    """
+
+    args = request.args if args is None else args
+    try:
+        limit = int(args.get('limit', PAGE_SIZE_DEFAULT))
+    except ValueError:
+        abort(400, message='limit must be an integer')
+    if limit < 1:
+        abort(400, message='limit must be positive')
+    limit = min(limit, PAGE_SIZE_MAX)
+    after = None
+    token = args.get('after')
+    if token:
+        try:
+            cursor = (serializer or cursor_serializer()).loads(token)
+        except BadSignature:
+            abort(400, message='invalid page cursor')
+        if cursor.get('endpoint') != endpoint:
+            abort(400, message='page cursor belongs to another collection')
+        after = cursor['after']
+    return limit, after
+
+
+def paginated_response(results, next_key, endpoint, limit):
+    """Wrap a page of results into a JSON response with next page cursor
+    in the "X-Next-Cursor" and "Link" headers when there are more rows.
+    endpoint is the collection name page cursors are bound to
+    """
+
+    resp = make_response(jsonify(results), 200)
+    resp.mimetype = r'application\json'
+    if next_key is not None:
+        token = cursor_serializer().dumps({'endpoint': endpoint,
+                                           'after': next_key})
+        # Route parameters and the cursor win over query string keys
+        params = {**request.args.to_dict(), **request.view_args,
+                  'limit': limit, 'after': token}
+        next_url = url_for(request.endpoint, **params)
+        resp.headers['X-Next-Cursor'] = token
+        resp.headers['Link'] = f'<{next_url}>; rel="next"'
+    return resp
+
+
+def table_version(table):
+    """Return (version, updated_at) of table. Read from the version
+    tables, the table itself is not touched
+    """
+
+    return tuple(db.session.execute(table_version_query(table)).first())
+
+
+def row_validators(model, condition):
+    """Return SELECT of (version, updated_at) validators of the row of
+    model matching condition: the row version and the last change of its
+    table. The row itself is not loaded
+    """
+
+    source = table_version_source(model.__tablename__)
+    return select(model.version, source.c.updated_at)\
+        .join(source, true()).where(condition)
+
+
+def collection_etag(table, version, path=None):
+    """ETag of a collection page depends on the table version and on the
+    query string which selects the page
+    """
+
+    page = zlib.crc32((path or request.full_path).encode())
+    return f'{table}-{version}-{page:08x}'
+
+
+def cache_valid(etag, last_modified, if_none_match, if_modified_since):
+    """Return True if client's copy described by parsed If-None-Match
+    ETags and If-Modified-Since date is still valid
+    """
+
+    if if_none_match:
+        return if_none_match.contains_weak(etag)
+    return bool(last_modified and if_modified_since and
+                last_modified.replace(microsecond=0) <= if_modified_since)
+
+
+def not_modified(etag, last_modified=None):
+    """Return 304 response if client's cached copy is still valid,
+    otherwise None
+    """
+
+    if not cache_valid(etag, last_modified, request.if_none_match,
+                       request.if_modified_since):
+        return None
+    return set_validators(make_response('', 304), etag, last_modified)
+
+
+def set_validators(resp, etag, last_modified=None):
+    resp.set_etag(etag)
+    if last_modified:
+        resp.last_modified = last_modified
+    return resp
+
+
+def search_args(fields, args=None):
+    """Return (filters, match) for collection search from the query string"""
+
+    args = request.args if args is None else args
+    filters = {field: args[field] for field in fields if args.get(field)}
+    match = args.get('match') or 'exact'
+    if match not in MATCH_MODES:
+        abort(400, message=f'match must be one of {", ".join(MATCH_MODES)}')
+    return filters, match
+
+
+def size_args():
+    """Return (min_size, max_size) group size bounds from the query string"""
+
+    bounds = []
+    for arg in ('min_size', 'max_size'):
+        try:
+            bounds.append(int(request.args[arg]) if request.args.get(arg)
+                          else None)
+        except ValueError:
+            abort(400, message=f'{arg} must be an integer')
+    return tuple(bounds)
+
+
+def stream_requested(args=None, accept=None):
+    """Return True if client asked for NDJSON stream instead of a page.
+    accept is parsed Accept header (MIMEAccept), of the current request
+    by default
+    """
+
+    args = request.args if args is None else args
+    accept = request.accept_mimetypes if accept is None else accept
+    if args.get('stream') in ('1', 'true'):
+        return True
+    best = accept.best_match(['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
 
+def ndjson_lines(rows, to_dict):
+    return ''.join(json.dumps(to_dict(row)) + '\n' for row in rows)
 
-api = Api(app)
-swagger = Swagger(app)
+
+def ndjson_response(query, to_dict):
+    """Stream query rows as NDJSON. Rows are fetched from a server-side
+    cursor in STREAM_BATCH_SIZE batches so memory use doesn't depend on
+    table size and first rows are sent before the query is exhausted.
+    The query is executed before the response starts, so a DB error is
+    answered with an error status instead of a truncated 200
+    """
+
+    result = query.execution_options(stream_results=True)\
+        .yield_per(STREAM_BATCH_SIZE)
+    rows = iter(result)
+
+    def generate():
+        for batch in iter(lambda: list(islice(rows, STREAM_BATCH_SIZE)), []):
+            yield ndjson_lines(batch, to_dict)
+
+    return Response(stream_with_context(generate()),
+                    mimetype=NDJSON_MIMETYPE)
+
+
+def split_page(rows, limit, key):
+    """Return (rows, next_key) of a page queried with one extra row, which
+    tells whether there is a next page
+    """
+
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, getattr(rows[-1], key)
+
+
+def page_statement(model, columns, key, text_fields, filters, match,
+                   after, limit):
+    """Return SELECT of one collection page ordered by key column plus one
+    extra row for split_page. Fuzzy matches are ranked by similarity and
+    only the first page is returned
+    """
+
+    conditions, order = search_conditions(model, filters, match, text_fields)
+    key = getattr(model, key)
+    stmt = select(*columns).where(*conditions).order_by(*order, key)
+    if match == 'fuzzy':
+        return stmt.limit(limit)
+    if after is not None:
+        stmt = stmt.where(key > after)
+    return stmt.limit(limit + 1)
+
+
+def students_page(filters, match, after, limit):
+    return page_statement(Student, STUDENT_COLUMNS, 'student_id',
+                          STUDENTS_TEXT_FIELDS, filters, match, after, limit)
+
+
+def courses_page(filters, match, after, limit):
+    return page_statement(Course, COURSE_COLUMNS, 'course_name',
+                          COURSES_TEXT_FIELDS, filters, match, after, limit)
+
+
+# Ids are taken from the identity sequence up front, RETURNING order is
+# not defined and could not be matched to the input rows
+NEXT_STUDENT_IDS = text("""
+    SELECT nextval(pg_get_serial_sequence('students', 'student_id'))
+    FROM generate_series(1, :count)""")
+
+
+def student_rows(students):
+    """Return rows to insert from a JSON list of students"""
+
+    try:
+        return [{"group_id": student['group_id'],
+                 "first_name": student['first_name'],
+                 "last_name": student['last_name']} for student in students]
+    except (KeyError, TypeError) as e:
+        abort(400, message=f'Info for students is not complete. '
+                           f'Field {str(e)} is required')
+
+
+def number_students(chunk, ids):
+    """Give ids drawn from the sequence to chunk rows in input order and
+    return them in that order
+    """
+
+    ids = sorted(ids)
+    for row, student_id in zip(chunk, ids):
+        row['student_id'] = student_id
+    return ids
+
+
+def bulk_insert_students(students):
+    """Insert list of student dicts with multi-row INSERT statements of
+    INSERT_CHUNK_SIZE rows and return their student ids in the same order
+    as the input list. Ids of a chunk are drawn from the sequence first
+    and given to the rows in input order
+    """
+
+    rows = student_rows(students)
+    student_ids = []
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[i:i + INSERT_CHUNK_SIZE]
+        student_ids.extend(number_students(chunk, db.session.execute(
+            NEXT_STUDENT_IDS, {'count': len(chunk)}).scalars()))
+        db.session.execute(insert(Student.__table__).values(chunk))
+    db.session.commit()
+    return student_ids
+
+
+def course_rows(courses):
+    """Return rows to insert from a JSON list of courses"""
+
+    try:
+        return [{"course_name": course["course_name"],
+                 "description": course['description']} for course in courses]
+    except (KeyError, TypeError) as e:
+        abort(400, message=f'Info for courses is not complete. '
+                           f'Field {str(e)} is required')
+
+
+def insert_courses(chunk):
+    """Single INSERT ... ON CONFLICT DO NOTHING instead of a SELECT per
+    course. RETURNING tells which rows were inserted
+    """
+
+    return pg_insert(Course.__table__).values(chunk)\
+        .on_conflict_do_nothing(index_elements=['course_name'])\
+        .returning(Course.__table__.c.course_name)
+
+
+def report_courses(rows, added, results):
+    """Add a message for every inserted row of rows and an error for every
+    already existing one to results
+    """
+
+    added = set(added)
+    for row in rows:
+        if row["course_name"] in added:
+            added.discard(row["course_name"])
+            results['message'].append(f'Course {row["course_name"]} added')
+        else:
+            results.setdefault('errors', []).append(
+                f'Course {row["course_name"]} is already exists')
+    return results
+
+
+def student_to_dict(student):
+    return {"student_id": student.student_id,
+            "first_name": student.first_name,
+            "last_name": student.last_name,
+            "group_id": student.group_id}
+
+
+def enrollment_response(student_id, course_name):
+    """Return the student and the course of one enrollment or 404"""
+
+    row = db.session.query(Student, Course)\
+        .join(StudentCourse, StudentCourse.student_id == Student.student_id)\
+        .join(Course, Course.course_name == StudentCourse.course_name)\
+        .filter(StudentCourse.student_id == student_id,
+                StudentCourse.course_name == course_name).first()
+    if row is None:
+        abort(404, description=f"Student {student_id} is not enrolled "
+                               f"to {course_name}")
+    student, course = row
+    results = student_to_dict(student)
+    results['course'] = {"course_name": course.course_name,
+                         "description": course.description}
+    json_report = jsonify(results)
+    resp = make_response(json_report, 200)
+    resp.mimetype = r'application\json'
+    return resp
+
+
+def json_list(json_data, key, item_type):
+    """Return list of item_type values from JSON list or {key: [...]}"""
+
+    if type(json_data) is dict:
+        json_data = json_data.get(key)
+    if type(json_data) is not list or not json_data:
+        abort(400, message=f'{key} must be a non empty list')
+    try:
+        return [item_type(value) for value in json_data]
+    except (TypeError, ValueError):
+        abort(400, message=f'{key} must be a list of {item_type.__name__}')
+
+
+def enroll_statement(students_filter, courses_filter):
+    """Return INSERT ... SELECT enrolling every existing student matching
+    students_filter to every existing course matching courses_filter.
+    Unknown ids and names are skipped, existing enrollments are left by
+    ON CONFLICT DO NOTHING on the primary key
+    """
+
+    # Rows are inserted and locked in key order by concurrent requests
+    pairs = select(Student.student_id, Course.course_name)\
+        .join(Course, courses_filter)\
+        .where(students_filter)\
+        .order_by(Student.student_id, Course.course_name)
+    return pg_insert(StudentCourse)\
+        .from_select(['student_id', 'course_name'], pairs)\
+        .on_conflict_do_nothing(index_elements=['student_id', 'course_name'])
 
 
 class Students(Resource):
     """A class to access Student model in DB for REST API"""
 
+    @query_budget(2)
     def get(self, api_version, student_id=None):
-        """Return all students' info if not student_id provided"""
+        """Return one page of students' info if not student_id provided"""
 
         if "v1" != api_version:
             abort(404, description=f"not supported api version: {api_version}")
         if student_id:
-            student = Student.query.get(student_id)
+            # Validators first, the row is loaded only if it's not cached
+            condition = Student.student_id == student_id
+            validators = db.session.execute(
+                row_validators(Student, condition)).first()
+            if not validators:
+                abort(400, description=f"Student with id={student_id} not found")
+            version, modified = validators
+            etag = f'students-{version}'
+            cached = not_modified(etag, modified)
+            if cached:
+                return cached
+            student = db.session.query(*STUDENT_COLUMNS)\
+                .filter(condition).first()
             if not student:
                 abort(400, description=f"Student with id={student_id} not found")
-            results = {"student_id": student.student_id,
-                       "first_name": student.first_name,
-                       "last_name": student.last_name,
-                       "group_id": student.group_id}
-        else:  # No student_id provided
-            students = Student.query.all()
-            if not students:
+            results = student_to_dict(student)
+        elif stream_requested():  # Full dump of students table
+            # Plain column rows skip ORM identity map bookkeeping
+            query = db.session.query(*STUDENT_COLUMNS)\
+                .order_by(Student.student_id)
+            return ndjson_response(query, student_to_dict)
+        else:  # No student_id provided. Querying one page of students
+            limit, after = page_args('students')
+            filters, match = search_args(['first_name', 'last_name',
+                                          'group_id'])
+            version, modified = table_version('students')
+            etag = collection_etag('students', version)
+            cached = not_modified(etag, modified)
+            if cached:
+                return cached
+            students, next_key = split_page(db.session.execute(
+                students_page(filters, match, after, limit)).all(),
+                limit, 'student_id')
+            if not students and after is None and not filters:
                 abort(400, description=f"Student with id={student_id} not found")
-            results = []
-            for student in students:
-                results.append({"student_id": student.student_id,
-                                "first_name": student.first_name,
-                                "last_name": student.last_name,
-                                "group_id": student.group_id})
+            results = [student_to_dict(student) for student in students]
+            return set_validators(
+                paginated_response(results, next_key, 'students', limit),
+                etag, modified)
         json_report = jsonify(results)
         resp = make_response(json_report, 200)
         resp.mimetype = r'application\json'
-        return resp
+        return set_validators(resp, etag, modified)
 
     def post(self, api_version, student_id=None):
         """Save student data from JSON which can be a dictionary or
@@ -90,18 +540,14 @@ class Students(Resource):
             db.session.commit()
             results['description'] = 'Students added successfully'
         elif type(json_data) is list:  # if json is a list of new students
-            for student in json_data:
-                new_student = Student(group_id=student['group_id'],
-                                      first_name=student['first_name'],
-                                      last_name=student['last_name'])
-                db.session.add(new_student)
-            db.session.commit()
+            results['student_ids'] = bulk_insert_students(json_data)
             results['description'] = 'Students added successfully'
         json_report = jsonify(results)
         resp = make_response(json_report, 201)
         resp.mimetype = r'application\json'
         return resp
 
+    @query_budget(2)
     def put(self, api_version, student_id):
         if "v1" != api_version:
             abort(404, description=f"not supported api version: {api_version}")
@@ -124,6 +570,7 @@ class Students(Resource):
         resp.mimetype = r'application\json'
         return resp
 
+    @query_budget(2)
     def delete(self, api_version, student_id):
         if "v1" != api_version:
             abort(400, description=f"not supported api version: {api_version}")
@@ -141,69 +588,90 @@ class Students(Resource):
 
 class Courses(Resource):
     """A class to access Course model in DB for REST API"""
+    @query_budget(3)
     def get(self, api_version, course_name=None):
         if "v1" != api_version:
             abort(404, message=f"not supported api version: {api_version}")
         if course_name:
-            course = Course.query.get(course_name.title())
+            # Validators first, the row is loaded only if it's not cached
+            validators = db.session.execute(row_validators(
+                Course, Course.course_name == course_name.title())).first()
+            if not validators:
+                abort(404, message=f"Course {course_name} not found")
+            version, modified = validators
+            etag = f'courses-{version}'
+            cached = not_modified(etag, modified)
+            if cached:
+                return cached
+            course = cached_course(course_name.title(), version=version)
             if not course:
                 abort(404, message=f"Course {course_name} not found")
-            results = {"course_name": course.course_name,
-                       "description": course.description}
+            results = {"course_name": course["course_name"],
+                       "description": course["description"]}
         else:
-            # No course_name provided. Querying all courses
-            query = db.session.query(Course).order_by(Course.course_name)
-            results = [{"course_name": course.course_name,
-                        "description": course.description}
-                       for course in query.all()]
+            # No course_name provided. Querying one page of courses
+            limit, after = page_args('courses')
+            filters, match = search_args(['course_name', 'description'])
+            version, modified = table_version('courses')
+            etag = collection_etag('courses', version)
+            cached = not_modified(etag, modified)
+            if cached:
+                return cached
+            # Served from cache only if it holds the version of the ETag
+            page = None if filters else \
+                reference_cache.page('courses', limit, after=after,
+                                     version=version)
+            if page is not None:
+                courses, _, next_key = page
+            else:
+                courses, next_key = split_page(db.session.execute(
+                    courses_page(filters, match, after, limit)).all(),
+                    limit, 'course_name')
+                courses = [row._mapping for row in courses]
+            results = [{"course_name": course["course_name"],
+                        "description": course["description"]}
+                       for course in courses]
+            return set_validators(
+                paginated_response(results, next_key, 'courses', limit),
+                etag, modified)
         json_report = jsonify(results)
         resp = make_response(json_report, 200)
         resp.mimetype = r'application\json'
-        return resp
+        return set_validators(resp, etag, modified)
 
     def post(self, api_version, course_name=None):
         if "v1" != api_version:
             abort(404, description=f"not supported api version: {api_version}")
         json_data = request.get_json()
         results = {'message': []}
-        if course_name:
-            # if json has info about only one course
-            # course_check = Course.query.get(course_name)
-            if Course.query.get(course_name):
+        if course_name or type(json_data) is dict:
+            # if json has info about only one course. The DB tells whether
+            # it exists, the cache could miss a course added just now
+            name = course_name or json_data["course_name"]
+            added = db.session.execute(insert_courses(
+                [{'course_name': name,
+                  'description': json_data['description']}])).first()
+            if not added:
                 abort(400, message=f'Course is already exists')
-            new_course = Course(course_name=course_name,
-                                description=json_data['description'])
-            db.session.add(new_course)
-            db.session.commit()
-            results['message'] = 'Course added successfully'
-        elif type(json_data) is dict:  # if json is a list of new courses
-            if Course.query.get(json_data["course_name"]):
-                abort(400, message=f'Course is already exists')
-            new_course = Course(course_name=json_data["course_name"],
-                                description=json_data['description'])
-            db.session.add(new_course)
-            results['message'].append(f'Course {json_data["course_name"]}'
-                                      f' added')
             db.session.commit()
+            if course_name:
+                results['message'] = 'Course added successfully'
+            else:
+                results['message'].append(f'Course {name} added')
         elif type(json_data) is list:  # json is a list of new courses
-            for course in json_data:
-                if Course.query.get(course["course_name"]):
-                    if 'errors' not in results:
-                        results['errors'] = []
-                    results['errors'].append(f'Course {course["course_name"]} '
-                                             f'is already exists')
-                    continue
-                new_course = Course(course_name=course["course_name"],
-                                    description=course['description'])
-                db.session.add(new_course)
-                results['message'].append(f'Course {course["course_name"]}'
-                                          f' added')
+            rows = course_rows(json_data)
+            added = []
+            for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+                stmt = insert_courses(rows[i:i + INSERT_CHUNK_SIZE])
+                added.extend(db.session.execute(stmt).scalars().all())
             db.session.commit()
+            report_courses(rows, added, results)
         json_report = jsonify(results)
         resp = make_response(json_report, 200)
         resp.mimetype = r'application\json'
         return resp
 
+    @query_budget(2)
     def put(self, api_version, course_name):
         if "v1" != api_version:
             abort(404, description=f"not supported api version: {api_version}")
@@ -227,6 +695,7 @@ class Courses(Resource):
         resp.mimetype = r'application\json'
         return resp
 
+    @query_budget(2)
     def delete(self, api_version, course_name):
         if "v1" != api_version:
             abort(404, description=f"not supported api version: {api_version}")
@@ -241,12 +710,280 @@ class Courses(Resource):
         return resp
 
 
+class StudentCourses(Resource):
+    """Courses a student is enrolled to"""
+
+    @query_budget(2)
+    def get(self, api_version, student_id, course_name=None):
+        """Return student's info with the list of their courses or with
+        the one course of the item route
+        """
+
+        if "v1" != api_version:
+            abort(404, description=f"not supported api version: {api_version}")
+        if course_name:
+            return enrollment_response(student_id, course_name)
+        # Courses of the student are loaded by one more SELECT ... IN
+        student = Student.query.options(selectinload(Student.courses))\
+            .filter(Student.student_id == student_id).first()
+        if not student:
+            abort(404, description=f"Student with id={student_id} not found")
+        results = student_to_dict(student)
+        results['courses'] = [{"course_name": course.course_name,
+                               "description": course.description}
+                              for course in student.courses]
+        json_report = jsonify(results)
+        resp = make_response(json_report, 200)
+        resp.mimetype = r'application\json'
+        return resp
+
+    @query_budget(2)
+    def post(self, api_version, student_id, course_name=None):
+        """Enroll student to courses from JSON list of course names or
+        {"course_names": [...]} with one INSERT ... SELECT statement
+        """
+
+        if "v1" != api_version:
+            abort(404, description=f"not supported api version: {api_version}")
+        names = [course_name] if course_name else \
+            json_list(request.get_json(silent=True), 'course_names', str)
+        stmt = enroll_statement(Student.student_id == student_id,
+                                Course.course_name.in_(names))\
+            .returning(StudentCourse.course_name)
+        enrolled = set(db.session.execute(stmt).scalars().all())
+        db.session.commit()
+        if not enrolled and not Student.query.get(student_id):
+            abort(404, description=f"Student with id={student_id} not found")
+        results = {'message': []}
+        for name in dict.fromkeys(names):
+            if name in enrolled:
+                results['message'].append(f'Student {student_id} enrolled '
+                                          f'to {name}')
+            else:
+                if 'errors' not in results:
+                    results['errors'] = []
+                results['errors'].append(f'Course {name} not found or '
+                                         f'already has student {student_id}')
+        json_report = jsonify(results)
+        resp = make_response(json_report, 201 if enrolled else 200)
+        resp.mimetype = r'application\json'
+        return resp
+
+    @query_budget(2)
+    def delete(self, api_version, student_id, course_name=None):
+        """Unenroll student from one course or from a JSON list of them"""
+
+        if "v1" != api_version:
+            abort(404, description=f"not supported api version: {api_version}")
+        names = [course_name] if course_name else \
+            json_list(request.get_json(silent=True), 'course_names', str)
+        stmt = delete(StudentCourse)\
+            .where(StudentCourse.student_id == student_id,
+                   StudentCourse.course_name.in_(names))\
+            .returning(StudentCourse.course_name)\
+            .execution_options(synchronize_session=False)
+        removed = db.session.execute(stmt).scalars().all()
+        if not removed:
+            abort(404, description=f"Student {student_id} is not enrolled "
+                                   f"to {', '.join(names)}")
+        db.session.commit()
+        results = {'message': f'Student {student_id} unenrolled from '
+                              f'{", ".join(sorted(set(removed)))}'}
+        json_report = jsonify(results)
+        resp = make_response(json_report, 200)
+        resp.mimetype = r'application\json'
+        return resp
+
+
+class CourseStudents(Resource):
+    """Students enrolled to a course"""
+
+    @query_budget(3)
+    def get(self, api_version, course_name, student_id=None):
+        """Return one page of students enrolled to the course or the one
+        student of the item route
+        """
+
+        if "v1" != api_version:
+            abort(404, description=f"not supported api version: {api_version}")
+        if student_id:
+            return enrollment_response(student_id, course_name)
+        scope = f'course_students/{course_name}'
+        limit, after = page_args(scope)
+        # Walks the (course_name, student_id) index in key order
+        query = db.session.query(Student.student_id, Student.first_name,
+                                 Student.last_name, Student.group_id)\
+            .join(StudentCourse, StudentCourse.student_id == Student.student_id)\
+            .filter(StudentCourse.course_name == course_name)\
+            .order_by(StudentCourse.student_id)
+        if after is not None:
+            query = query.filter(StudentCourse.student_id > after)
+        students = query.limit(limit + 1).all()
+        if not students and after is None and not cached_course(course_name):
+            abort(404, message=f"Course {course_name} not found")
+        next_key = None
+        if len(students) > limit:
+            students = students[:limit]
+            next_key = students[-1].student_id
+        results = [student_to_dict(student) for student in students]
+        return paginated_response(results, next_key, scope, limit)
+
+    @query_budget(2)
+    def post(self, api_version, course_name, student_id=None):
+        """Enroll students from JSON list of ids or {"student_ids": [...]}
+        to the course with one INSERT ... SELECT statement
+        """
+
+        if "v1" != api_version:
+            abort(404, description=f"not supported api version: {api_version}")
+        student_ids = [student_id] if student_id else \
+            json_list(request.get_json(silent=True), 'student_ids', int)
+        stmt = enroll_statement(Student.student_id.in_(student_ids),
+                                Course.course_name == course_name)\
+            .returning(StudentCourse.student_id)
+        enrolled = set(db.session.execute(stmt).scalars().all())
+        db.session.commit()
+        if not enrolled and not cached_course(course_name):
+            abort(404, message=f"Course {course_name} not found")
+        results = {'message': []}
+        for sid in dict.fromkeys(student_ids):
+            if sid in enrolled:
+                results['message'].append(f'Student {sid} enrolled '
+                                          f'to {course_name}')
+            else:
+                if 'errors' not in results:
+                    results['errors'] = []
+                results['errors'].append(f'Student {sid} not found or '
+                                         f'already enrolled to {course_name}')
+        json_report = jsonify(results)
+        resp = make_response(json_report, 201 if enrolled else 200)
+        resp.mimetype = r'application\json'
+        return resp
+
+    @query_budget(2)
+    def delete(self, api_version, course_name, student_id=None):
+        """Unenroll one student or a JSON list of them from the course"""
+
+        if "v1" != api_version:
+            abort(404, description=f"not supported api version: {api_version}")
+        student_ids = [student_id] if student_id else \
+            json_list(request.get_json(silent=True), 'student_ids', int)
+        stmt = delete(StudentCourse)\
+            .where(StudentCourse.course_name == course_name,
+                   StudentCourse.student_id.in_(student_ids))\
+            .returning(StudentCourse.student_id)\
+            .execution_options(synchronize_session=False)
+        removed = db.session.execute(stmt).scalars().all()
+        if not removed:
+            abort(404, description=f"No such students enrolled "
+                                   f"to {course_name}")
+        db.session.commit()
+        results = {'message': f'{len(set(removed))} students unenrolled '
+                              f'from {course_name}'}
+        json_report = jsonify(results)
+        resp = make_response(json_report, 200)
+        resp.mimetype = r'application\json'
+        return resp
+
+
+class GroupSizes(Resource):
+    """Number of students in every group"""
+
+    @query_budget(3)
+    def get(self, api_version):
+        """Return sizes of groups, optionally only groups with
+        min_size <= students <= max_size
+        """
+
+        if "v1" != api_version:
+            abort(404, description=f"not supported api version: {api_version}")
+        min_size, max_size = size_args()
+        # Sizes change only with students table
+        version, modified = table_version('students')
+        etag = collection_etag('group_sizes', version)
+        cached = not_modified(etag, modified)
+        if cached:
+            return cached
+        results = cached_group_sizes(min_size, max_size, version=version)
+        json_report = jsonify(results)
+        resp = make_response(json_report, 200)
+        resp.mimetype = r'application\json'
+        return set_validators(resp, etag, modified)
+
+
+class CourseEnrollments(Resource):
+    """Number of students enrolled to courses"""
+
+    @query_budget(2)
+    def get(self, api_version, course_name=None):
+        """Return number of students of the course or of every course"""
+
+        if "v1" != api_version:
+            abort(404, description=f"not supported api version: {api_version}")
+        # Counts are kept by triggers, courses without a row have none
+        rows = db.session.query(
+            Course.course_name,
+            func.coalesce(CourseEnrollmentCount.students, 0))\
+            .outerjoin(CourseEnrollmentCount,
+                       CourseEnrollmentCount.course_name ==
+                       Course.course_name)
+        if course_name:
+            row = rows.filter(Course.course_name == course_name).first()
+            if row is None:
+                abort(404, message=f"Course {course_name} not found")
+            results = {"course_name": row[0], "students": row[1]}
+        else:
+            results = [{"course_name": name, "students": students}
+                       for name, students in
+                       rows.order_by(Course.course_name)]
+        json_report = jsonify(results)
+        resp = make_response(json_report, 200)
+        resp.mimetype = r'application\json'
+        return resp
+
+
 api.add_resource(Students, '/api/<string:api_version>/students/',
                  '/api/<string:api_version>/students/<int:student_id>/',
                  endpoint='students')
 api.add_resource(Courses, '/api/<string:api_version>/courses/',
                  '/api/<string:api_version>/courses/<course_name>/',
                  endpoint='courses')
+api.add_resource(GroupSizes, '/api/<string:api_version>/groups/sizes/',
+                 endpoint='group_sizes')
+api.add_resource(CourseEnrollments, '/api/<string:api_version>/enrollments/',
+                 '/api/<string:api_version>/enrollments/<course_name>/',
+                 endpoint='course_enrollments')
+api.add_resource(StudentCourses,
+                 '/api/<string:api_version>/students/<int:student_id>/courses/',
+                 '/api/<string:api_version>/students/<int:student_id>/courses/'
+                 '<course_name>/',
+                 endpoint='student_courses')
+api.add_resource(CourseStudents,
+                 '/api/<string:api_version>/courses/<course_name>/students/',
+                 '/api/<string:api_version>/courses/<course_name>/students/'
+                 '<int:student_id>/',
+                 endpoint='course_students')
+
+
+def init_app(app):
+    """Register API resources on app, flasgger docs only if enabled"""
+
+    api.init_app(app)
+    if app.config.get('FLASGGER'):
+        Swagger(app)
+    app.cli.add_command(apispec_command)
+
+
+@click.command('apispec')
+@click.option('-o', '--output', type=click.File('w'), default='-')
+def apispec_command(output):
+    """Write OpenAPI spec generated by flasgger from API docstrings"""
+
+    swagger = getattr(current_app, 'swag', None) or Swagger(current_app)
+    with current_app.test_request_context():
+        json.dump(swagger.get_apispecs(), output, indent=2)
+
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    from app import create_app
+    create_app().run(debug=True)
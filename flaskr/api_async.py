@@ -0,0 +1,405 @@
+"""Asyncio variant of the REST API in api.py.
+Serves the same /api/v1/students/ and /api/v1/courses/ endpoints with the
+same JSON contract, page cursors, search parameters, NDJSON streaming and
+ETags, but runs on aiohttp with SQLAlchemy asyncio engine over asyncpg.
+A single process keeps many requests in flight while they wait for
+Postgres, connections come from an async pool sized by
+ASYNC_DB_POOL_SIZE and ASYNC_DB_MAX_OVERFLOW, other DB_* settings are
+shared with app.py. asyncpg names its prepared statements, which breaks
+PgBouncer transaction pooling, so with PGBOUNCER set this server connects
+to DATABASE_DIRECT_URL.
+
+    Example:
+        python api_async.py --port 8080
+        gunicorn api_async:create_app --worker-class aiohttp.GunicornWebWorker
+
+    Classes:
+        Students:
+            Handles GET, POST, PUT, DELETE request for students table
+        Courses:
+            Handles GET, POST, PUT, DELETE request for courses table
+"""
+
+import argparse
+import json
+import os
+from aiohttp import web
+from flask_restful import abort
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header, parse_etags
+from app import Student, Course, table_version_query, DATABASE_URL, \
+    DATABASE_DIRECT_URL, SECRET_KEY, DB_SETTINGS, session_settings
+from api import INSERT_CHUNK_SIZE, STREAM_BATCH_SIZE, NDJSON_MIMETYPE, \
+    NEXT_STUDENT_IDS, STUDENT_COLUMNS, COURSE_COLUMNS, cursor_serializer, \
+    page_args, search_args, stream_requested, collection_etag, cache_valid, \
+    students_page, courses_page, split_page, ndjson_lines, student_to_dict, \
+    student_rows, number_students, course_rows, insert_courses, \
+    report_courses, row_validators
+
+
+ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 20))
+ASYNC_DB_MAX_OVERFLOW = int(os.environ.get('ASYNC_DB_MAX_OVERFLOW', 10))
+
+students = Student.__table__
+courses = Course.__table__
+page_cursors = cursor_serializer(SECRET_KEY)
+
+
+@web.middleware
+async def json_errors(request, handler):
+    """Answer flask_restful abort, raised here and by the api.py helpers,
+    with its JSON body
+    """
+
+    try:
+        return await handler(request)
+    except HTTPException as e:
+        data = getattr(e, 'data', None) or {'message': e.description}
+        return web.json_response(data, status=e.code)
+
+
+def check_version(api_version, status=404, field='description'):
+    if "v1" != api_version:
+        abort(status, **{field: f"not supported api version: {api_version}"})
+
+
+async def read_json(request):
+    """Return JSON body of request, invalid JSON gets the 400 Flask
+    answers it with
+    """
+
+    try:
+        return await request.json()
+    except json.JSONDecodeError:
+        abort(400)
+
+
+def course_to_dict(row):
+    return {"course_name": row.course_name,
+            "description": row.description}
+
+
+async def table_version(conn, table):
+    return tuple((await conn.execute(table_version_query(table))).first())
+
+
+def not_modified(request, etag, last_modified=None):
+    """Return 304 response if client's cached copy is still valid"""
+
+    if_none_match = parse_etags(request.headers.get('If-None-Match'))
+    if not cache_valid(etag, last_modified, if_none_match,
+                       request.if_modified_since):
+        return None
+    return set_validators(web.Response(status=304), etag, last_modified)
+
+
+def set_validators(resp, etag, last_modified=None):
+    resp.etag = etag
+    if last_modified:
+        resp.last_modified = last_modified
+    return resp
+
+
+def paginated_response(request, results, next_key, endpoint, limit):
+    resp = web.json_response(results)
+    if next_key is not None:
+        token = page_cursors.dumps({'endpoint': endpoint,
+                                    'after': next_key})
+        next_url = request.rel_url.update_query(limit=limit, after=token)
+        resp.headers['X-Next-Cursor'] = token
+        resp.headers['Link'] = f'<{next_url}>; rel="next"'
+    return resp
+
+
+def accept_mimetypes(request):
+    return parse_accept_header(request.headers.get('Accept'), MIMEAccept)
+
+
+async def ndjson_response(request, engine, stmt):
+    """Stream rows of stmt as NDJSON from a server-side cursor. Headers are
+    sent once the cursor is open, so a DB error is answered with 500
+    instead of a truncated 200
+    """
+
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt)
+        resp = web.StreamResponse(headers={'Content-Type': NDJSON_MIMETYPE})
+        await resp.prepare(request)
+        async for rows in result.partitions(STREAM_BATCH_SIZE):
+            await resp.write(ndjson_lines(rows, student_to_dict).encode())
+    await resp.write_eof()
+    return resp
+
+
+class Students(web.View):
+    """Async access to students table, same contract as api.Students"""
+
+    @property
+    def engine(self):
+        return self.request.app['engine']
+
+    async def get(self):
+        api_version = self.request.match_info['api_version']
+        student_id = self.request.match_info.get('student_id')
+        check_version(api_version)
+        if student_id:
+            student_id = int(student_id)
+            condition = students.c.student_id == student_id
+            async with self.engine.connect() as conn:
+                # Validators first, the row is loaded only if not cached
+                validators = (await conn.execute(
+                    row_validators(Student, condition))).first()
+                if not validators:
+                    abort(400, description=f"Student with id={student_id} "
+                                           f"not found")
+                version, modified = validators
+                etag = f'students-{version}'
+                cached = not_modified(self.request, etag, modified)
+                if cached is not None:
+                    return cached
+                student = (await conn.execute(
+                    select(*STUDENT_COLUMNS).where(condition))).first()
+            if not student:
+                abort(400, description=f"Student with id={student_id} "
+                                       f"not found")
+            return set_validators(
+                web.json_response(student_to_dict(student)), etag, modified)
+        query = self.request.query
+        if stream_requested(query, accept_mimetypes(self.request)):
+            stmt = select(*STUDENT_COLUMNS).order_by(students.c.student_id)
+            return await ndjson_response(self.request, self.engine, stmt)
+        limit, after = page_args('students', query, page_cursors)
+        filters, match = search_args(['first_name', 'last_name',
+                                      'group_id'], query)
+        async with self.engine.connect() as conn:
+            version, modified = await table_version(conn, 'students')
+            etag = collection_etag('students', version,
+                                   str(self.request.rel_url))
+            cached = not_modified(self.request, etag, modified)
+            if cached is not None:
+                return cached
+            rows, next_key = split_page((await conn.execute(
+                students_page(filters, match, after, limit))).all(),
+                limit, 'student_id')
+        if not rows and after is None and not filters:
+            abort(400, description="Student with id=None not found")
+        results = [student_to_dict(row) for row in rows]
+        return set_validators(
+            paginated_response(self.request, results, next_key, 'students',
+                               limit), etag, modified)
+
+    async def post(self):
+        api_version = self.request.match_info['api_version']
+        student_id = self.request.match_info.get('student_id')
+        check_version(api_version)
+        json_data = await read_json(self.request)
+        results = {}
+        async with self.engine.begin() as conn:
+            if student_id:  # if json has info about only one student
+                student_id = int(student_id)
+                exists = (await conn.execute(
+                    select(students.c.student_id)
+                    .where(students.c.student_id == student_id))).first()
+                if exists:
+                    abort(404, description='student_id is already exists')
+                await conn.execute(insert(students).values(
+                    student_id=student_id, group_id=json_data['group_id'],
+                    first_name=json_data['first_name'],
+                    last_name=json_data['last_name']))
+                results['description'] = 'Student added successfully'
+            elif type(json_data) is dict:
+                await conn.execute(insert(students).values(
+                    group_id=json_data['group_id'],
+                    first_name=json_data['first_name'],
+                    last_name=json_data['last_name']))
+                results['description'] = 'Students added successfully'
+            elif type(json_data) is list:
+                rows = student_rows(json_data)
+                student_ids = []
+                for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+                    chunk = rows[i:i + INSERT_CHUNK_SIZE]
+                    ids = (await conn.execute(
+                        NEXT_STUDENT_IDS, {'count': len(chunk)})).scalars()
+                    student_ids.extend(number_students(chunk, ids))
+                    await conn.execute(insert(students).values(chunk))
+                results['student_ids'] = student_ids
+                results['description'] = 'Students added successfully'
+        return web.json_response(results, status=201)
+
+    async def put(self):
+        api_version = self.request.match_info['api_version']
+        student_id = int(self.request.match_info['student_id'])
+        check_version(api_version)
+        json_data = await read_json(self.request)
+        try:
+            values = {'first_name': json_data['first_name'],
+                      'last_name': json_data['last_name'],
+                      'group_id': json_data['group_id']}
+        except KeyError as e:
+            abort(400, message=f'Info for student with id = {student_id} is'
+                               f' not complete. Field {str(e)} is required')
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                update(students).where(students.c.student_id == student_id)
+                .values(**values))
+            if not result.rowcount:
+                abort(400, message=f'student_id {student_id} not found')
+        return web.json_response({'message': "OK"})
+
+    async def delete(self):
+        api_version = self.request.match_info['api_version']
+        student_id = int(self.request.match_info['student_id'])
+        check_version(api_version, status=400)
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                delete(students).where(students.c.student_id == student_id))
+            if not result.rowcount:
+                abort(400, description=f"Student with {student_id} "
+                                       f"not found")
+        return web.json_response(
+            {'message': f'Deleted student with id={student_id}'})
+
+
+class Courses(web.View):
+    """Async access to courses table, same contract as api.Courses"""
+
+    @property
+    def engine(self):
+        return self.request.app['engine']
+
+    async def get(self):
+        api_version = self.request.match_info['api_version']
+        course_name = self.request.match_info.get('course_name')
+        check_version(api_version, field='message')
+        if course_name:
+            condition = courses.c.course_name == course_name.title()
+            async with self.engine.connect() as conn:
+                # Validators first, the row is loaded only if not cached
+                validators = (await conn.execute(
+                    row_validators(Course, condition))).first()
+                if not validators:
+                    abort(404, message=f"Course {course_name} not found")
+                version, modified = validators
+                etag = f'courses-{version}'
+                cached = not_modified(self.request, etag, modified)
+                if cached is not None:
+                    return cached
+                course = (await conn.execute(
+                    select(*COURSE_COLUMNS).where(condition))).first()
+            if not course:
+                abort(404, message=f"Course {course_name} not found")
+            return set_validators(
+                web.json_response(course_to_dict(course)), etag, modified)
+        query = self.request.query
+        limit, after = page_args('courses', query, page_cursors)
+        filters, match = search_args(['course_name', 'description'], query)
+        async with self.engine.connect() as conn:
+            version, modified = await table_version(conn, 'courses')
+            etag = collection_etag('courses', version,
+                                   str(self.request.rel_url))
+            cached = not_modified(self.request, etag, modified)
+            if cached is not None:
+                return cached
+            rows, next_key = split_page((await conn.execute(
+                courses_page(filters, match, after, limit))).all(),
+                limit, 'course_name')
+        results = [course_to_dict(row) for row in rows]
+        return set_validators(
+            paginated_response(self.request, results, next_key, 'courses',
+                               limit), etag, modified)
+
+    async def post(self):
+        api_version = self.request.match_info['api_version']
+        course_name = self.request.match_info.get('course_name')
+        check_version(api_version)
+        json_data = await read_json(self.request)
+        results = {'message': []}
+        async with self.engine.begin() as conn:
+            if course_name or type(json_data) is dict:
+                # if json has info about only one course
+                name = course_name or json_data["course_name"]
+                added = (await conn.execute(insert_courses(
+                    [{'course_name': name,
+                      'description': json_data['description']}]))).first()
+                if not added:
+                    abort(400, message='Course is already exists')
+                if course_name:
+                    results['message'] = 'Course added successfully'
+                else:
+                    results['message'].append(f'Course {name} added')
+            elif type(json_data) is list:  # json is a list of new courses
+                rows = course_rows(json_data)
+                added = []
+                for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+                    stmt = insert_courses(rows[i:i + INSERT_CHUNK_SIZE])
+                    added.extend((await conn.execute(stmt)).scalars())
+                report_courses(rows, added, results)
+        return web.json_response(results)
+
+    async def put(self):
+        api_version = self.request.match_info['api_version']
+        course_name = self.request.match_info['course_name']
+        check_version(api_version)
+        json_data = await read_json(self.request)
+        values = {'description': json_data.get('description')}
+        if json_data.get('course_name'):
+            values['course_name'] = json_data.get('course_name')
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                update(courses).where(courses.c.course_name == course_name)
+                .values(**values))
+            if not result.rowcount:
+                abort(404, message=f"Course {course_name} not found")
+        return web.json_response({'message': f"{course_name} info updated"})
+
+    async def delete(self):
+        api_version = self.request.match_info['api_version']
+        course_name = self.request.match_info['course_name']
+        check_version(api_version)
+        async with self.engine.begin() as conn:
+            result = await conn.execute(
+                delete(courses).where(courses.c.course_name == course_name))
+            if not result.rowcount:
+                abort(404, description=f"Course {course_name} not found")
+        return web.json_response({'message': f'Deleted course {course_name}'})
+
+
+async def create_engine_ctx(aio_app):
+    """Open async connection pool on startup, close it on cleanup"""
+
+    url = DATABASE_DIRECT_URL if DB_SETTINGS['PGBOUNCER'] else DATABASE_URL
+    settings = {name: str(value)
+                for name, value in session_settings(DB_SETTINGS).items()}
+    aio_app['engine'] = create_async_engine(
+        make_url(url).set(drivername='postgresql+asyncpg'),
+        pool_size=ASYNC_DB_POOL_SIZE, max_overflow=ASYNC_DB_MAX_OVERFLOW,
+        pool_timeout=DB_SETTINGS['DB_POOL_TIMEOUT'],
+        pool_recycle=DB_SETTINGS['DB_POOL_RECYCLE'],
+        pool_pre_ping=DB_SETTINGS['DB_POOL_PRE_PING'],
+        connect_args={'server_settings': settings})
+    yield
+    await aio_app['engine'].dispose()
+
+
+def create_app():
+    aio_app = web.Application(middlewares=[json_errors])
+    aio_app.cleanup_ctx.append(create_engine_ctx)
+    aio_app.router.add_view(r'/api/{api_version}/students/', Students)
+    aio_app.router.add_view(
+        r'/api/{api_version}/students/{student_id:\d+}/', Students)
+    aio_app.router.add_view(r'/api/{api_version}/courses/', Courses)
+    aio_app.router.add_view(r'/api/{api_version}/courses/{course_name}/',
+                            Courses)
+    return aio_app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
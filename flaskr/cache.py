@@ -0,0 +1,222 @@
+"""Process-local cache of small reference tables (courses, groups).
+Every table is loaded as a whole into an ordered dict and kept for ttl
+seconds. Entries are invalidated:
+    - in this process right after a session commit which wrote the table
+    - in every process by Postgres NOTIFY sent by bump_table_version
+      trigger on the "table_changed" channel, which is delivered only
+      after the writing transaction commits
+The cache is bypassed (get returns None) while the LISTEN connection is
+down, so missed notifications can't leave stale entries behind.
+Tables with more than max_rows rows are not cached.
+Besides tables the cache can keep data computed from a table, e.g.
+aggregates, sources maps such entry to the table it is invalidated with.
+With a versions function every entry remembers the table version read
+before it was loaded. Callers which build validators (ETags) from the
+table version pass it to get/page, an entry of another version is not
+served and an older one is dropped, so a body never outlives a NOTIFY
+which hasn't arrived yet under a newer validator.
+
+    Classes:
+        ReferenceCache:
+            Cache with TTL and LISTEN/NOTIFY invalidation
+"""
+
+import os
+import select
+import threading
+import time
+from collections import namedtuple
+import psycopg2
+from session_events import listen_once
+
+
+NOTIFY_CHANNEL = 'table_changed'
+
+CachedTable = namedtuple('CachedTable',
+                         ['rows', 'keys', 'positions', 'expires', 'version'])
+# Marker for tables which are too big to be cached
+TOO_BIG = CachedTable(None, None, None, 0, None)
+
+
+class ReferenceCache:
+    """Cache of whole reference tables. loaders maps table name to a
+    function returning list of at most limit (key, row) pairs in table
+    order, it's called with limit max_rows + 1. sources
+    maps names of loaders which are not tables to their source table.
+    versions is an optional function returning current version of a table
+    """
+
+    def __init__(self, dsn, loaders, ttl=60, max_rows=10_000,
+                 reconnect_delay=5, sources=None, versions=None):
+        self.dsn = dsn
+        self.loaders = loaders
+        self.sources = sources or {}
+        self.versions = versions
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.reconnect_delay = reconnect_delay
+        self._entries = {}
+        self._generations = {table: 0 for table in loaders}
+        self._lock = threading.Lock()
+        self._listening = threading.Event()
+        self._listener_pid = None
+
+    def get(self, table, version=None):
+        """Return ordered dict key -> row of table or None if the table
+        can't be served from cache right now (or not in given version)
+        """
+
+        return self._entry(table, version).rows
+
+    def page(self, table, limit, after=None, before=None, version=None):
+        """Return (rows, prev_key, next_key) page of table rows following
+        key after or preceding key before. prev_key/next_key are None on
+        the first/last page. None if the page can't be served from cache
+        """
+
+        entry = self._entry(table, version)
+        if entry.rows is None:
+            return None
+        key = before if before is not None else after
+        position = entry.positions.get(key) if key is not None else -1
+        if position is None:
+            return None
+        if before is not None:
+            start = max(position - limit, 0)
+            keys = entry.keys[start:position]
+        else:
+            start = position + 1
+            keys = entry.keys[start:start + limit]
+        end = start + len(keys)
+        prev_key = keys[0] if keys and start > 0 else None
+        next_key = keys[-1] if keys and end < len(entry.keys) else None
+        return [entry.rows[key] for key in keys], prev_key, next_key
+
+    def _entry(self, table, version=None):
+        self._ensure_listener()
+        if not self._listening.is_set():
+            return TOO_BIG
+        entry = self._entries.get(table)
+        now = time.monotonic()
+        if entry is None or entry.expires < now:
+            generation = self._generations[table]
+            # Read before the rows, so rows are never older than it
+            loaded_version = self.versions(self.sources.get(table, table)) \
+                if self.versions else None
+            # One row over max_rows tells the table is too big, without
+            # reading all of it
+            pairs = self.loaders[table](self.max_rows + 1)
+            if len(pairs) > self.max_rows:
+                entry = TOO_BIG._replace(expires=now + self.ttl)
+            else:
+                rows = dict(pairs)
+                keys = list(rows)
+                entry = CachedTable(rows, keys, {key: i for i, key in
+                                                 enumerate(keys)},
+                                    now + self.ttl, loaded_version)
+            with self._lock:
+                # Don't store data loaded before a concurrent invalidation
+                if generation == self._generations[table]:
+                    self._entries[table] = entry
+        if version is not None and entry.rows is not None and \
+                entry.version != version:
+            # Newer version committed, its NOTIFY is still on the way
+            if entry.version is None or entry.version < version:
+                self.invalidate(table)
+            return TOO_BIG
+        return entry
+
+    def invalidate(self, table=None):
+        """Drop cached table and entries computed from it or everything
+        if table is None
+        """
+
+        with self._lock:
+            for name in self._generations:
+                if table is None or table in (name, self.sources.get(name)):
+                    self._generations[name] += 1
+                    self._entries.pop(name, None)
+
+    def _ensure_listener(self):
+        """Start LISTEN thread once per process (again after fork)"""
+
+        if self._listener_pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self._listening.clear()
+            self._entries.clear()
+            thread = threading.Thread(target=self._listen, daemon=True,
+                                      name='reference-cache-listener')
+            thread.start()
+        # Give the first connection a moment, requests bypass cache till then
+        self._listening.wait(0.5)
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+                # Notifications could be missed while we were disconnected
+                self.invalidate()
+                self._listening.set()
+                while True:
+                    if select.select([conn], [], [], 60) != ([], [], []):
+                        conn.poll()
+                        while conn.notifies:
+                            self.invalidate(conn.notifies.pop(0).payload)
+            except psycopg2.Error:
+                self._listening.clear()
+                self.invalidate()
+            finally:
+                if conn is not None:
+                    conn.close()
+            time.sleep(self.reconnect_delay)
+
+
+def written_tables(session):
+    return session.info.setdefault('written_tables', set())
+
+
+def collect_flushed(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        written_tables(session).add(obj.__table__.name)
+
+
+def collect_executed(orm_execute_state):
+    if orm_execute_state.is_select:
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is not None:
+        written_tables(orm_execute_state.session).add(table.name)
+
+
+def invalidate_written(session):
+    """Invalidate written tables in the cache of the app the session
+    belongs to (Flask-SQLAlchemy sessions know their app)
+    """
+
+    tables = session.info.pop('written_tables', ())
+    app = getattr(session, 'app', None)
+    cache = app.extensions.get('reference_cache') if app else None
+    if cache is not None:
+        for table in tables:
+            cache.invalidate(table)
+
+
+def forget_written(session):
+    session.info.pop('written_tables', None)
+
+
+def invalidate_on_commit(session):
+    """Invalidate tables written by session as soon as it commits"""
+
+    listen_once(session, (('after_flush', collect_flushed),
+                          ('do_orm_execute', collect_executed),
+                          ('after_commit', invalidate_written),
+                          ('after_rollback', forget_written)))
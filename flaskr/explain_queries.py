@@ -0,0 +1,156 @@
+"""Check that queries of the search views and enrollment lookups are served
+by indexes. Run it against a large dataset (see load_data.py), on a small
+one Postgres prefers sequential scans anyway.
+Every query is run with EXPLAIN and the script fails if a checked table is
+read with a Seq Scan. Search queries get the LIMIT of the first page the
+views fetch. Tables smaller than MIN_ROWS (e.g. courses) are skipped, a
+sequential scan is the best plan for them, so are queries whose sample
+values can't be taken from an empty table.
+
+    Example:
+        python load_data.py --students 1000000
+        python explain_queries.py
+"""
+
+import json
+import sys
+from sqlalchemy import text
+from app import Student, Course, create_app, db, students_query, \
+    courses_query, group_sizes_query, PAGE_SIZE_DEFAULT
+
+
+MIN_ROWS = 10_000
+
+
+def plan_scans(plan):
+    """Yield (node type, relation name) of every scan node in a plan"""
+
+    if 'Relation Name' in plan:
+        yield plan['Node Type'], plan['Relation Name']
+    for subplan in plan.get('Plans', []):
+        yield from plan_scans(subplan)
+
+
+def explain(query):
+    """Return plan of ORM query or SQL statement with its bound values"""
+
+    compiled = getattr(query, 'statement', query)\
+        .compile(dialect=db.engine.dialect)
+    row = db.session.connection().exec_driver_sql(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    if isinstance(row, str):
+        row = json.loads(row)
+    return row[0]['Plan']
+
+
+def table_rows(table):
+    """Return planner estimate of table rows count"""
+
+    return db.session.execute(
+        text('SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)'),
+        {'table': table}).scalar()
+
+
+def sample_value(column, table):
+    """Return some non NULL value of column or None if there is none"""
+
+    return db.session.execute(text(
+        f'SELECT {column} FROM {table} WHERE {column} IS NOT NULL LIMIT 1'))\
+        .scalar()
+
+
+def first_page(query, columns, ranked=False):
+    """Return query of the first page the search views fetch, see
+    app.keyset_page. The LIMIT changes the plan, e.g. an index scan in
+    the order of the page key stops after a page of rows
+    """
+
+    return query.with_entities(*columns)\
+        .limit(PAGE_SIZE_DEFAULT if ranked else PAGE_SIZE_DEFAULT + 1)
+
+
+def checked_queries():
+    """Return list of (name, query, tables which must be read by index).
+    query is None if there are no rows to take sample values from
+    """
+
+    first_name = sample_value('first_name', 'students')
+    last_name = sample_value('last_name', 'students')
+    group_id = sample_value('group_id', 'students')
+    description = sample_value('description', 'courses')
+    course_name = sample_value('course_name', 'students_courses')
+    student_id = sample_value('student_id', 'students_courses')
+    student_columns = [Student.student_id, Student.first_name,
+                       Student.last_name, Student.group_id]
+    course_columns = [Course.course_name, Course.description]
+    queries = []
+
+    def check(name, tables, samples, build):
+        queries.append((name, None if None in samples else build(), tables))
+
+    students_filters = [
+        {'first_name': first_name},
+        {'last_name': last_name},
+        {'group_id': group_id},
+        {'first_name': first_name, 'last_name': last_name},
+        {'first_name': first_name, 'group_id': group_id},
+        {'last_name': last_name, 'group_id': group_id},
+    ]
+    for filters in students_filters:
+        check(f'students_view {sorted(filters)}', ['students'],
+              filters.values(),
+              lambda: first_page(students_query(filters), student_columns))
+    check('students_view prefix [last_name]', ['students'], [last_name],
+          lambda: first_page(
+              students_query({'last_name': last_name[:3]}, 'prefix'),
+              student_columns))
+    check('students_view fuzzy [first_name, last_name]', ['students'],
+          [first_name, last_name],
+          lambda: first_page(
+              students_query({'first_name': first_name[:-1],
+                              'last_name': last_name}, 'fuzzy'),
+              student_columns, ranked=True))
+    check('courses_view [description]', ['courses'], [description],
+          lambda: first_page(
+              courses_query({'description': description}), course_columns))
+    check('group sizes [min_size, max_size]', ['students'], [],
+          lambda: group_sizes_query(10, 30))
+    check('students of a course', ['students_courses'], [course_name],
+          lambda: text("""
+        SELECT first_name, last_name
+        FROM students
+        WHERE student_id IN
+        (SELECT student_id FROM students_courses
+         WHERE course_name = :course_name)""")
+          .bindparams(course_name=course_name))
+    check('courses of a student', ['students_courses'], [student_id],
+          lambda: text("""
+        SELECT course_name FROM students_courses
+        WHERE student_id = :student_id""").bindparams(student_id=student_id))
+    return queries
+
+
+def main():
+    failed = False
+    with create_app().app_context():
+        for name, query, tables in checked_queries():
+            if query is None:
+                print(f'SKIP {name}: no rows to take sample values from')
+                continue
+            tables = [table for table in tables
+                      if table_rows(table) >= MIN_ROWS]
+            if not tables:
+                print(f'SKIP {name}: tables are smaller than {MIN_ROWS} rows')
+                continue
+            scans = list(plan_scans(explain(query)))
+            seq_scans = [table for node, table in scans
+                         if node == 'Seq Scan' and table in tables]
+            status = 'FAIL' if seq_scans else 'OK'
+            failed = failed or bool(seq_scans)
+            print(f'{status:4} {name}: '
+                  + ', '.join(f'{node} on {table}' for node, table in scans))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""Large scale synthetic data generator for load testing.
+All random draws are done with NumPy in batches, so 10M+ students and
+30M+ enrollments can be generated in seconds. Data is emitted chunk by
+chunk as column arrays and never held in memory as a whole.
+
+Output is deterministic for a given seed and chunk_size: every chunk has
+its own random stream derived from (seed, stream, chunk_index), so any
+chunk can be regenerated independently, e.g. in another process.
+
+    Example:
+        sizes = gen_groups_sizes(10_000_000, seed=42)
+        names = gen_group_names(len(sizes), seed=42)
+        for chunk_index, start, stop in chunk_bounds(10_000_000):
+            students = gen_students_chunk(chunk_index, start, stop,
+                                          names, sizes, seed=42)
+            enrollments = gen_enrollments_chunk(chunk_index, start, stop,
+                                                course_names, seed=42)
+"""
+
+import numpy as np
+from generate_data import FIRST_NAMES, LAST_NAMES
+
+
+CHUNK_SIZE = 100_000
+
+# Independent random streams for each kind of generated data
+GROUP_SIZES_STREAM = 0
+GROUP_NAMES_STREAM = 1
+STUDENTS_STREAM = 2
+ENROLLMENTS_STREAM = 3
+
+_first_names = np.array(FIRST_NAMES)
+_last_names = np.array(LAST_NAMES)
+
+
+def _rng(seed, stream, chunk_index=0):
+    return np.random.default_rng([seed, stream, chunk_index])
+
+
+def chunk_bounds(n_rows, chunk_size=CHUNK_SIZE):
+    """Return list of (chunk_index, start, stop) covering n_rows"""
+
+    return [(i, start, min(start + chunk_size, n_rows))
+            for i, start in enumerate(range(0, n_rows, chunk_size))]
+
+
+def gen_groups_sizes(n_students, seed, min_size=10, max_size=30):
+    """Return array of group sizes uniformly drawn from
+    [min_size, max_size] which sums up to n_students. Last group takes
+    the remainder and can be smaller than min_size
+    """
+
+    if not 0 < min_size <= max_size:
+        raise ValueError('0 < min_size <= max_size expected')
+    if n_students < 0:
+        raise ValueError('n_students must not be negative')
+    if n_students == 0:
+        return np.zeros(0, dtype=np.int64)
+    rng = _rng(seed, GROUP_SIZES_STREAM)
+    sizes = rng.integers(min_size, max_size + 1,
+                         size=-(-n_students // min_size))
+    bounds = np.cumsum(sizes)
+    n_groups = int(np.searchsorted(bounds, n_students)) + 1
+    sizes = sizes[:n_groups]
+    sizes[-1] -= bounds[n_groups - 1] - n_students
+    return sizes
+
+
+def gen_group_names(n_groups, seed):
+    """Return array of n_groups unique random names like 'ab_cd'.
+    Names get longer than 4 letters when 4 letters are not enough
+    """
+
+    length = 4
+    while 26 ** length < n_groups * 4:
+        length += 1
+    rng = _rng(seed, GROUP_NAMES_STREAM)
+    ids = rng.choice(26 ** length, size=n_groups, replace=False)
+    powers = 26 ** np.arange(length - 1, -1, -1, dtype=np.int64)
+    letters = ((ids[:, None] // powers) % 26 + ord('a')).astype(np.uint8)
+    underscore = np.full((n_groups, 1), ord('_'), dtype=np.uint8)
+    chars = np.hstack([letters[:, :2], underscore, letters[:, 2:]])
+    return chars.view(f'S{length + 1}').ravel().astype(str)
+
+
+def gen_students_chunk(chunk_index, start, stop, group_names, groups_sizes,
+                       seed):
+    """Return (student_ids, first_names, last_names, group_ids) arrays for
+    students with 0-based positions [start, stop). student_id = position + 1
+    """
+
+    rng = _rng(seed, STUDENTS_STREAM, chunk_index)
+    n = stop - start
+    positions = np.arange(start, stop, dtype=np.int64)
+    group_index = np.searchsorted(np.cumsum(groups_sizes), positions,
+                                  side='right')
+    first_names = _first_names[rng.integers(0, len(_first_names), size=n)]
+    last_names = _last_names[rng.integers(0, len(_last_names), size=n)]
+    return positions + 1, first_names, last_names, group_names[group_index]
+
+
+def gen_enrollments_chunk(chunk_index, start, stop, course_names, seed,
+                          min_courses=1, max_courses=3, courses_p=None):
+    """Return (student_ids, course_names) arrays of enrollments for students
+    with 0-based positions [start, stop). Each student gets from
+    min_courses to max_courses distinct courses. courses_p is an optional
+    list of probabilities for every number of courses in that range,
+    uniform by default
+    """
+
+    course_names = np.asarray(course_names)
+    if not 0 <= min_courses <= max_courses <= len(course_names):
+        raise ValueError('0 <= min_courses <= max_courses <= '
+                         'number of courses expected')
+    rng = _rng(seed, ENROLLMENTS_STREAM, chunk_index)
+    n = stop - start
+    counts = rng.choice(np.arange(min_courses, max_courses + 1), size=n,
+                        p=courses_p)
+    # Random permutation of courses per student, first `count` are taken
+    order = np.argsort(rng.random((n, len(course_names))),
+                       axis=1)[:, :max_courses]
+    taken = np.arange(max_courses) < counts[:, None]
+    student_ids = np.repeat(np.arange(start, stop, dtype=np.int64) + 1,
+                            counts)
+    return student_ids, course_names[order[taken]]
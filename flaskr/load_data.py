@@ -0,0 +1,205 @@
+"""Parallel COPY based loader for seeding large synthetic datasets.
+Rows produced by generate_large_data are streamed into Postgres with
+COPY ... FROM STDIN chunk by chunk. Chunks are split by student id range
+between a pool of worker processes, each with its own connection.
+Constraints and indexes of the loaded tables are dropped before the load
+and created again after it, which is much faster than maintaining them
+row by row. Triggers are disabled for the load the same way, the table
+versions and enrollment counts they keep are rebuilt once at the end.
+Tables must exist, create them with: python app.py db upgrade
+
+    Example:
+        python load_data.py --students 10000000 --workers 8 --seed 42
+"""
+
+import argparse
+import os
+import time
+import psycopg2
+from concurrent.futures import ProcessPoolExecutor
+from generate_data import DATABASE_URL, STUDENTS_COURSES_COLUMNS, \
+    gen_courses, copy_rows
+from generate_large_data import CHUNK_SIZE, chunk_bounds, gen_groups_sizes, \
+    gen_group_names, gen_students_chunk, gen_enrollments_chunk
+
+
+LOADED_TABLES = ['groups', 'courses', 'students', 'students_courses']
+# Loaded tables with the bump_table_version trigger
+VERSIONED_TABLES = ['groups', 'courses', 'students']
+
+# Data generated once per worker process by _init_worker
+_worker = {}
+
+
+def drop_constraints_and_indexes(cursor, tables):
+    """Drop constraints and indexes of tables and return list of DDL
+    statements which create them again in a valid order
+    """
+
+    cursor.execute("""
+        SELECT conrelid::regclass::text, conname, contype,
+               pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = ANY(%(tables)s::regclass[])
+           OR confrelid = ANY(%(tables)s::regclass[])
+        ORDER BY contype = 'f' DESC""", {'tables': tables})
+    constraints = cursor.fetchall()
+    cursor.execute("""
+        SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        LEFT JOIN pg_constraint c ON c.conindid = i.indexrelid
+        WHERE i.indrelid = ANY(%(tables)s::regclass[])
+          AND c.oid IS NULL""", {'tables': tables})
+    indexes = cursor.fetchall()
+    for table, name, _, _ in constraints:
+        cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+    for name, _ in indexes:
+        cursor.execute(f'DROP INDEX {name}')
+    # Primary and unique keys first, foreign keys need them
+    restore = [f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}'
+               for table, name, kind, definition in reversed(constraints)]
+    restore.extend(definition for _, definition in indexes)
+    return restore
+
+
+def set_triggers(cursor, tables, enabled):
+    """Enable or disable user triggers of tables, constraint triggers of
+    foreign keys are left alone
+    """
+
+    action = 'ENABLE' if enabled else 'DISABLE'
+    for table in tables:
+        cursor.execute(f'ALTER TABLE {table} {action} TRIGGER USER')
+
+
+def rebuild_trigger_data(cursor):
+    """Record what the triggers disabled for the load would have: one
+    change of every versioned table (with its NOTIFY) and enrollment
+    counts of all courses
+    """
+
+    cursor.execute("""
+        INSERT INTO table_changes (table_name)
+        SELECT unnest(%(tables)s::text[])""", {'tables': VERSIONED_TABLES})
+    cursor.execute("""
+        SELECT pg_notify('table_changed', table_name)
+        FROM unnest(%(tables)s::text[]) table_name""",
+                   {'tables': VERSIONED_TABLES})
+    cursor.execute('DELETE FROM course_enrollment_counts')
+    cursor.execute("""
+        INSERT INTO course_enrollment_counts (course_name, students)
+        SELECT course_name, count(*) FROM students_courses
+        GROUP BY course_name""")
+
+
+def _init_worker(n_students, seed, min_group_size, max_group_size, dsn):
+    sizes = gen_groups_sizes(n_students, seed, min_group_size,
+                             max_group_size)
+    _worker['groups_sizes'] = sizes
+    _worker['group_names'] = gen_group_names(len(sizes), seed)
+    _worker['course_names'] = [course[0] for course in gen_courses()]
+    _worker['conn'] = psycopg2.connect(dsn)
+
+
+def _load_chunks(chunks, seed, min_courses, max_courses):
+    """Generate and COPY given (chunk_index, start, stop) chunks of students
+    and their enrollments. Return number of loaded enrollments
+    """
+
+    conn = _worker['conn']
+    enrollments_count = 0
+    for chunk_index, start, stop in chunks:
+        ids, first_names, last_names, group_ids = gen_students_chunk(
+            chunk_index, start, stop, _worker['group_names'],
+            _worker['groups_sizes'], seed)
+        copy_rows(conn, 'students',
+                  ['student_id', 'first_name', 'last_name', 'group_id'],
+                  zip(ids.tolist(), first_names.tolist(),
+                      last_names.tolist(), group_ids.tolist()),
+                  null_columns=['group_id'])
+        student_ids, course_names = gen_enrollments_chunk(
+            chunk_index, start, stop, _worker['course_names'], seed,
+            min_courses, max_courses)
+        copy_rows(conn, 'students_courses', STUDENTS_COURSES_COLUMNS,
+                  zip(student_ids.tolist(), course_names.tolist()))
+        conn.commit()
+        enrollments_count += len(student_ids)
+    return enrollments_count
+
+
+def load_dataset(n_students, seed=0, workers=None, chunk_size=CHUNK_SIZE,
+                 min_group_size=10, max_group_size=30, min_courses=1,
+                 max_courses=3, dsn=DATABASE_URL):
+    """Replace content of school tables with a generated dataset of
+    n_students students. Return number of loaded enrollments
+    """
+
+    workers = workers or os.cpu_count()
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            set_triggers(cursor, LOADED_TABLES, enabled=False)
+            cursor.execute('TRUNCATE ' + ', '.join(LOADED_TABLES) +
+                           ' RESTART IDENTITY')
+            restore = drop_constraints_and_indexes(cursor, LOADED_TABLES)
+        conn.commit()
+        try:
+            sizes = gen_groups_sizes(n_students, seed, min_group_size,
+                                     max_group_size)
+            copy_rows(conn, 'groups', ['group_name'],
+                      ((name,) for name in
+                       gen_group_names(len(sizes), seed).tolist()))
+            copy_rows(conn, 'courses', ['course_name', 'description'],
+                      gen_courses())
+            conn.commit()
+            chunks = chunk_bounds(n_students, chunk_size)
+            # Every worker takes every n-th chunk so work is spread evenly
+            batches = [chunks[i::workers] for i in range(workers)]
+            with ProcessPoolExecutor(
+                    workers, initializer=_init_worker,
+                    initargs=(n_students, seed, min_group_size,
+                              max_group_size, dsn)) as executor:
+                enrollments_count = sum(executor.map(
+                    _load_chunks, batches, [seed] * workers,
+                    [min_courses] * workers, [max_courses] * workers))
+        finally:
+            conn.rollback()
+            with conn.cursor() as cursor:
+                for statement in restore:
+                    cursor.execute(statement)
+                set_triggers(cursor, LOADED_TABLES, enabled=True)
+                rebuild_trigger_data(cursor)
+            conn.commit()
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT setval(pg_get_serial_sequence('students', 'student_id'),
+                              greatest(max(student_id), 1))
+                FROM students""")
+        conn.commit()
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            # VACUUM sets visibility map, index only scans need it
+            cursor.execute('VACUUM ANALYZE ' + ', '.join(LOADED_TABLES))
+    finally:
+        conn.close()
+    return enrollments_count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--min-group-size', type=int, default=10)
+    parser.add_argument('--max-group-size', type=int, default=30)
+    parser.add_argument('--min-courses', type=int, default=1)
+    parser.add_argument('--max-courses', type=int, default=3)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    enrollments = load_dataset(args.students, args.seed, args.workers,
+                               args.chunk_size, args.min_group_size,
+                               args.max_group_size, args.min_courses,
+                               args.max_courses)
+    print(f'Loaded {args.students} students and {enrollments} enrollments '
+          f'in {time.perf_counter() - started:.1f}s')
@@ -0,0 +1,315 @@
+"""Load test of the REST API and HTML search views of a running server.
+A workload profile is a weighted mix of operations (see PROFILES). For
+every dataset scale, profile and concurrency level `concurrency` clients
+run operations back to back for `duration` seconds after a warmup.
+Requests/sec and p50/p95/p99/max latency are reported per endpoint and
+saved as JSON. With --baseline a previous results file is compared and
+the script fails if throughput dropped or p95 grew by more than
+--max-regression.
+--scales reseeds the server's database (DATABASE_URL) with load_data
+before each scale, without it the current dataset is used.
+
+    Example:
+        python api.py &
+        python load_test.py --scales 10000,1000000 --profiles read,mixed \\
+            --concurrency 1,16,64 --output results.json
+        python load_test.py --baseline results.json --output new.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import aiohttp
+from generate_data import FIRST_NAMES, LAST_NAMES
+
+
+# Relative weights of operations in every workload profile
+PROFILES = {
+    'read': {'students_page': 25, 'student': 30, 'students_filter': 10,
+             'courses_page': 10, 'course': 10, 'students_search': 10,
+             'courses_search': 5},
+    'mixed': {'students_page': 20, 'student': 25, 'students_filter': 10,
+              'courses_page': 5, 'course': 10, 'students_search': 10,
+              'courses_search': 5, 'student_create': 7, 'student_update': 5,
+              'student_delete': 3},
+    'write': {'student': 10, 'student_create': 40, 'student_update': 30,
+              'student_delete': 20},
+}
+WARMUP = 5
+DURATION = 30
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of sorted values"""
+
+    if not values:
+        return None
+    rank = math.ceil(q / 100 * len(values)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class Workload:
+    """Operations of a load test client. Every operation returns
+    (endpoint, method, url, json body)
+    """
+
+    def __init__(self, samples, rng):
+        self.samples = samples
+        self.rng = rng
+        # Students created by this client, updated and deleted later so
+        # writes don't change the size of the dataset much
+        self.created = []
+
+    def students_page(self):
+        limit = self.rng.choice((10, 100))
+        return 'GET /api/v1/students/', 'GET', \
+            f'/api/v1/students/?limit={limit}', None
+
+    def student(self):
+        student_id = self.rng.choice(self.samples['student_ids'])
+        return 'GET /api/v1/students/<id>/', 'GET', \
+            f'/api/v1/students/{student_id}/', None
+
+    def students_filter(self):
+        return 'GET /api/v1/students/?last_name', 'GET', \
+            f'/api/v1/students/?last_name={self.rng.choice(LAST_NAMES)}' \
+            f'&limit=100', None
+
+    def courses_page(self):
+        return 'GET /api/v1/courses/', 'GET', '/api/v1/courses/', None
+
+    def course(self):
+        course_name = self.rng.choice(self.samples['course_names'])
+        return 'GET /api/v1/courses/<name>/', 'GET', \
+            f'/api/v1/courses/{course_name}/', None
+
+    def students_search(self):
+        return 'GET /students/search', 'GET', \
+            f'/students/search?first_name={self.rng.choice(FIRST_NAMES)}' \
+            f'&last_name={self.rng.choice(LAST_NAMES)}', None
+
+    def courses_search(self):
+        course_name = self.rng.choice(self.samples['course_names'])
+        return 'GET /courses/search', 'GET', \
+            f'/courses/search?course_name={course_name}', None
+
+    def student_create(self):
+        return 'POST /api/v1/students/', 'POST', '/api/v1/students/', \
+            [self.new_student()]
+
+    def student_update(self):
+        if not self.created:
+            return self.student_create()
+        student_id = self.rng.choice(self.created)
+        return 'PUT /api/v1/students/<id>/', 'PUT', \
+            f'/api/v1/students/{student_id}/', self.new_student()
+
+    def student_delete(self):
+        if not self.created:
+            return self.student_create()
+        student_id = self.created.pop(self.rng.randrange(len(self.created)))
+        return 'DELETE /api/v1/students/<id>/', 'DELETE', \
+            f'/api/v1/students/{student_id}/', None
+
+    def new_student(self):
+        return {'first_name': self.rng.choice(FIRST_NAMES),
+                'last_name': self.rng.choice(LAST_NAMES),
+                'group_id': self.rng.choice(self.samples['group_names'])}
+
+
+async def fetch_samples(session):
+    """Collect ids and names of existing rows used by operations"""
+
+    async with session.get('/api/v1/students/?limit=1000') as resp:
+        students = json.loads(await resp.text())
+    async with session.get('/api/v1/courses/?limit=1000') as resp:
+        courses = json.loads(await resp.text())
+    if not students or not courses:
+        sys.exit('Load test needs a non empty dataset, use --scales')
+    return {'student_ids': [s['student_id'] for s in students],
+            'group_names': sorted({s['group_id'] for s in students
+                                   if s['group_id']}),
+            'course_names': [c['course_name'] for c in courses]}
+
+
+async def client(session, workload, weights, measure_from, deadline,
+                 latencies, statuses):
+    operations = list(weights)
+    cumulative = [sum(list(weights.values())[:i + 1])
+                  for i in range(len(weights))]
+    while time.perf_counter() < deadline:
+        operation = workload.rng.choices(operations,
+                                         cum_weights=cumulative)[0]
+        endpoint, method, url, body = getattr(workload, operation)()
+        started = time.perf_counter()
+        try:
+            async with session.request(method, url, json=body) as resp:
+                data = await resp.read()
+                status = resp.status
+        except aiohttp.ClientError as e:
+            data, status = b'', type(e).__name__
+        finished = time.perf_counter()
+        if method == 'POST' and status == 201:
+            workload.created.extend(json.loads(data)['student_ids'])
+        if started >= measure_from:
+            latencies.setdefault(endpoint, []).append(finished - started)
+            counts = statuses.setdefault(endpoint, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+    # Leave the dataset as it was
+    for student_id in workload.created:
+        async with session.delete(f'/api/v1/students/{student_id}/'):
+            pass
+
+
+async def run(base_url, profile, concurrency, duration, warmup, seed):
+    """Run one profile at one concurrency level, return its summary"""
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(base_url, connector=connector) as session:
+        samples = await fetch_samples(session)
+        latencies, statuses = {}, {}
+        measure_from = time.perf_counter() + warmup
+        deadline = measure_from + duration
+        await asyncio.gather(*(
+            client(session, Workload(samples, random.Random(seed + i)),
+                   PROFILES[profile], measure_from, deadline, latencies,
+                   statuses)
+            for i in range(concurrency)))
+    return summarize(latencies, statuses, duration)
+
+
+def summarize(latencies, statuses, duration):
+    endpoints = {}
+    for endpoint, values in sorted(latencies.items()):
+        values.sort()
+        errors = sum(count for status, count in statuses[endpoint].items()
+                     if not status.isdigit() or int(status) >= 500)
+        endpoints[endpoint] = {
+            'requests': len(values),
+            'errors': errors,
+            'statuses': statuses[endpoint],
+            'rps': len(values) / duration,
+            'mean_ms': sum(values) / len(values) * 1000,
+            **{f'p{q}_ms': percentile(values, q) * 1000 for q in PERCENTILES},
+            'max_ms': values[-1] * 1000,
+        }
+    values = sorted(v for endpoint in latencies.values() for v in endpoint)
+    total = {
+        'requests': len(values),
+        'errors': sum(e['errors'] for e in endpoints.values()),
+        'rps': len(values) / duration,
+        **{f'p{q}_ms': (percentile(values, q) or 0) * 1000
+           for q in PERCENTILES},
+    }
+    return {'total': total, 'endpoints': endpoints}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], text=True,
+                              capture_output=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, max_regression):
+    """Return list of regressions of current run against baseline"""
+
+    def runs(results):
+        return {(r['scale'], r['profile'], r['concurrency']): r
+                for r in results['runs']}
+
+    regressions = []
+    baseline_runs = runs(baseline)
+    for key, run_result in runs(current).items():
+        if key not in baseline_runs:
+            continue
+        old_endpoints = baseline_runs[key]['endpoints']
+        for endpoint, new in run_result['endpoints'].items():
+            old = old_endpoints.get(endpoint)
+            if not old:
+                continue
+            if new['rps'] < old['rps'] * (1 - max_regression):
+                regressions.append(f'{key} {endpoint}: rps {old["rps"]:.1f}'
+                                   f' -> {new["rps"]:.1f}')
+            if new['p95_ms'] > old['p95_ms'] * (1 + max_regression):
+                regressions.append(f'{key} {endpoint}: p95 '
+                                   f'{old["p95_ms"]:.1f}ms -> '
+                                   f'{new["p95_ms"]:.1f}ms')
+    return regressions
+
+
+def print_run(run_result):
+    print(f'scale={run_result["scale"]} profile={run_result["profile"]} '
+          f'concurrency={run_result["concurrency"]}')
+    rows = [('total', run_result['total'])] + \
+        list(run_result['endpoints'].items())
+    for endpoint, stats in rows:
+        print(f'  {endpoint:36} {stats["rps"]:9.1f} req/s  '
+              f'p50 {stats["p50_ms"]:8.1f}ms  p95 {stats["p95_ms"]:8.1f}ms  '
+              f'p99 {stats["p99_ms"]:8.1f}ms  errors {stats["errors"]}')
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--profiles', default='read,mixed')
+    parser.add_argument('--concurrency', type=int_list, default=[1, 16])
+    parser.add_argument('--scales', type=int_list, default=[None])
+    parser.add_argument('--duration', type=float, default=DURATION)
+    parser.add_argument('--warmup', type=float, default=WARMUP)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    args = parser.parse_args()
+    profiles = args.profiles.split(',')
+    for profile in profiles:
+        if profile not in PROFILES:
+            parser.error(f'unknown profile {profile}, '
+                         f'choose from {", ".join(PROFILES)}')
+    results = {'started_at': datetime.now(timezone.utc).isoformat(),
+               'git_revision': git_revision(),
+               'base_url': args.base_url, 'duration': args.duration,
+               'warmup': args.warmup, 'seed': args.seed, 'runs': []}
+    for scale in args.scales:
+        if scale is not None:
+            from load_data import load_dataset
+            print(f'Seeding {scale} students')
+            load_dataset(scale, seed=args.seed)
+        for profile in profiles:
+            for concurrency in args.concurrency:
+                summary = asyncio.run(run(args.base_url, profile, concurrency,
+                                          args.duration, args.warmup,
+                                          args.seed))
+                run_result = {'scale': scale, 'profile': profile,
+                              'concurrency': concurrency, **summary}
+                results['runs'].append(run_result)
+                print_run(run_result)
+    output = args.output or \
+        f'load_test_{datetime.now():%Y%m%d_%H%M%S}.json'
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results saved to {output}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), results, args.max_regression)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""Prometheus metrics of the web app served at /metrics:
+    - http_request_duration_seconds: latency histogram per route, method
+      and status. Streamed responses are observed when the stream ends
+    - http_requests_in_progress: requests being served per route
+    - http_request_sql_duration_seconds: time spent in SQL per request
+    - http_request_sql_queries: SQL statements executed per request
+    - db_pool_*: SQLAlchemy pool size, checked out and overflow connections
+Routes are labeled by URL rule (e.g. /students/update/<int:student_id>),
+requests which match no rule are labeled "unmatched".
+Every process keeps its own metrics. Under a multi-process server set
+PROMETHEUS_MULTIPROC_DIR to a writable directory and request metrics
+are aggregated from all workers (pool metrics are the scraped worker's).
+
+Statements repeated at least SQL_N_PLUS_ONE_THRESHOLD times in one
+request are logged as suspected N+1 queries. Views decorated with
+query_budget log requests which run more statements than allowed, with
+SQL_QUERY_BUDGET_STRICT (on by default in testing) the request fails
+with QueryBudgetExceeded instead. The budget is checked before every
+commit too, so a failed request doesn't leave its write behind; a
+request which goes over budget only after it committed is logged.
+Statements run inside budget_exempt(), e.g. reference cache reloads
+shared by many requests, are counted but not against the budget.
+Tests can also check any block:
+    with count_queries() as stats:
+        client.get('/api/v1/students/1/')
+    assert stats.queries <= 2
+
+    Functions:
+        init_metrics:
+            Register request hooks, SQL timing and /metrics view on app
+        instrument_engine:
+            Count and time SQL statements of one more engine (replicas)
+        query_budget:
+            Decorator setting max number of SQL statements of a view
+        count_queries:
+            Context manager counting SQL statements run in this thread
+        budget_exempt:
+            Context manager keeping SQL statements out of query budgets
+"""
+
+import functools
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from flask import g, request, has_request_context, Response, current_app
+from prometheus_client import Histogram, Gauge, CollectorRegistry, \
+    REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+from session_events import listen_once
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency',
+    ['method', 'route', 'status'], buckets=LATENCY_BUCKETS)
+REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress', 'HTTP requests being served',
+    ['method', 'route'], multiprocess_mode='livesum')
+REQUEST_SQL_TIME = Histogram(
+    'http_request_sql_duration_seconds', 'Time spent in SQL per HTTP request',
+    ['method', 'route'], buckets=LATENCY_BUCKETS)
+REQUEST_SQL_QUERIES = Histogram(
+    'http_request_sql_queries', 'SQL statements executed per HTTP request',
+    ['method', 'route'], buckets=(1, 2, 3, 5, 10, 20, 50, 100, 500))
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Request ran more SQL statements than its query budget"""
+
+
+class QueryStats:
+    """SQL statements counted by count_queries"""
+
+    def __init__(self):
+        self.queries = 0
+        self.exempt = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+
+    def add(self, statement, elapsed, exempt=False):
+        self.queries += 1
+        self.exempt += exempt
+        self.sql_time += elapsed
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        """Return list of (count, statement) run at least threshold times"""
+
+        return [(count, statement) for statement, count
+                in self.statements.most_common() if count >= threshold]
+
+
+@contextmanager
+def count_queries():
+    """Count SQL statements run in this thread inside the block"""
+
+    stats = QueryStats()
+    counters = _local.__dict__.setdefault('counters', [])
+    counters.append(stats)
+    try:
+        yield stats
+    finally:
+        counters.remove(stats)
+
+
+@contextmanager
+def budget_exempt():
+    """Don't count SQL statements run in this thread inside the block
+    against query budget of the request
+    """
+
+    _local.exempt = getattr(_local, 'exempt', 0) + 1
+    try:
+        yield
+    finally:
+        _local.exempt -= 1
+
+
+def query_budget(max_queries):
+    """Limit number of SQL statements of a request to a view"""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            g.query_budget = max_queries
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class PoolCollector:
+    """Collect connection pool stats of an engine on every scrape"""
+
+    def __init__(self, engine=None):
+        self.engine = engine
+
+    def collect(self):
+        if self.engine is None:
+            return
+        pool = self.engine.pool
+        stats = [('db_pool_size', 'Configured pool size', 'size'),
+                 ('db_pool_checked_out_connections',
+                  'Connections checked out of the pool', 'checkedout'),
+                 ('db_pool_checked_in_connections',
+                  'Idle connections in the pool', 'checkedin'),
+                 ('db_pool_overflow_connections',
+                  'Connections opened above pool size', 'overflow')]
+        for name, documentation, stat in stats:
+            if hasattr(pool, stat):  # Not every pool class has them
+                # QueuePool counts overflow from -size up
+                yield GaugeMetricFamily(name, documentation,
+                                        value=max(getattr(pool, stat)(), 0))
+
+
+# Registered once per process, init_metrics points it to app's engine
+POOL_COLLECTOR = PoolCollector()
+REGISTRY.register(POOL_COLLECTOR)
+
+
+def route_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def strict_budget():
+    return current_app.config.get('SQL_QUERY_BUDGET_STRICT',
+                                  current_app.testing)
+
+
+def budget_breach(stats, method, route):
+    """Return message if the request ran more statements than its query
+    budget, otherwise None
+    """
+
+    budget = g.get('query_budget')
+    queries = stats.queries - stats.exempt
+    if budget is not None and queries > budget:
+        return f'{method} {route} ran {queries} SQL statements, ' \
+               f'query budget is {budget}'
+    return None
+
+
+def check_queries(stats, method, route):
+    """Log suspected N+1 statements and enforce query budget of a view"""
+
+    threshold = current_app.config.get('SQL_N_PLUS_ONE_THRESHOLD', 5)
+    for count, statement in stats.repeated(threshold):
+        current_app.logger.warning(
+            f'Suspected N+1 query in {method} {route}: {count} x '
+            f'{" ".join(statement.split())[:200]}')
+    message = budget_breach(stats, method, route)
+    if message is None:
+        return
+    # A committed write can't be taken back by failing the request
+    if strict_budget() and not g.get('db_committed'):
+        raise QueryBudgetExceeded(message)
+    current_app.logger.warning(message)
+
+
+def check_budget_before_commit(session, *args):
+    """Fail a request over its query budget before its transaction
+    commits. Runs after flushes too, commit flushes before committing
+    """
+
+    if not has_request_context() or 'metrics' not in g or \
+            not strict_budget():
+        return
+    message = budget_breach(g.metrics['sql'], g.metrics['method'],
+                            g.metrics['route'])
+    if message is not None:
+        raise QueryBudgetExceeded(message)
+
+
+def remember_commit(session):
+    if has_request_context():
+        g.db_committed = True
+
+
+def watch_commits(session):
+    """Check query budgets on commits of session"""
+
+    listen_once(session, (('before_commit', check_budget_before_commit),
+                          ('after_flush_postexec', check_budget_before_commit),
+                          ('after_commit', remember_commit)))
+
+
+def instrument_engine(engine):
+    """Count and time SQL statements run by engine. Statements executed
+    with metrics_ignore execution option are not counted
+    """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query(conn, cursor, statement, parameters, context,
+                    executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        if context is not None and \
+                context.execution_options.get('metrics_ignore'):
+            return
+        exempt = getattr(_local, 'exempt', 0) > 0
+        for stats in getattr(_local, 'counters', ()):
+            stats.add(statement, elapsed, exempt)
+        if has_request_context() and 'metrics' in g:
+            g.metrics['sql'].add(statement, elapsed, exempt)
+
+
+def init_metrics(app, engine, session=None):
+    POOL_COLLECTOR.engine = engine
+    instrument_engine(engine)
+    if session is not None:
+        watch_commits(session)
+
+    @app.before_request
+    def start_request():
+        g.metrics = {'started': time.perf_counter(), 'sql': QueryStats(),
+                     'method': request.method, 'route': route_label()}
+        REQUESTS_IN_PROGRESS.labels(request.method, g.metrics['route']).inc()
+
+    @app.after_request
+    def observe_request(response):
+        # Keep the dict, SQL time of a streamed response is added later
+        metrics = g.get('metrics')
+        # after_request runs again for the error response of a failed check
+        if metrics is None or metrics.get('observed'):
+            return response
+        metrics['observed'] = True
+        status = str(response.status_code)
+        method, route = metrics['method'], metrics['route']
+        try:
+            check_queries(metrics['sql'], method, route)
+        except QueryBudgetExceeded:
+            REQUESTS_IN_PROGRESS.labels(method, route).dec()
+            raise
+
+        def observe():
+            REQUEST_LATENCY.labels(method, route, status)\
+                .observe(time.perf_counter() - metrics['started'])
+            REQUEST_SQL_TIME.labels(method, route)\
+                .observe(metrics['sql'].sql_time)
+            REQUEST_SQL_QUERIES.labels(method, route)\
+                .observe(metrics['sql'].queries)
+            REQUESTS_IN_PROGRESS.labels(method, route).dec()
+
+        response.call_on_close(observe)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_view():
+        registry = REGISTRY
+        if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            registry.register(POOL_COLLECTOR)
+        return Response(generate_latest(registry),
+                        content_type=CONTENT_TYPE_LATEST)
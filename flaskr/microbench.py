@@ -0,0 +1,145 @@
+"""Microbenchmarks of request hot paths which run without a database:
+    - row to dict loops of Students.get/Courses.get on ORM objects and on
+      plain column rows
+    - jsonify of a page of students
+    - SQLAlchemy query construction and compilation of the search views
+    - Jinja rendering of students.html with thousands of rows
+Inputs are fixed so runs are comparable. Every benchmark is calibrated
+to run for about 0.1s per sample and repeated --repeat times,
+min/median/mean/stdev of time per call are reported and can be saved as
+JSON.
+
+    Example:
+        python microbench.py
+        python microbench.py --filter render --repeat 10 --output bench.json
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import timeit
+from collections import namedtuple
+from flask import jsonify, render_template, stream_template
+from sqlalchemy.dialects import postgresql
+from app import Student, Course, create_app, students_query, \
+    courses_query, course_to_dict
+from api import student_to_dict
+from generate_data import FIRST_NAMES, LAST_NAMES, gen_courses
+
+
+ROWS = 1000
+RENDER_ROWS = 5000
+REPEAT = 5
+
+StudentRow = namedtuple('StudentRow',
+                        ['student_id', 'first_name', 'last_name', 'group_id'])
+
+
+def student_rows(n):
+    return [StudentRow(i, FIRST_NAMES[i % len(FIRST_NAMES)],
+                       LAST_NAMES[i * 7 % len(LAST_NAMES)], f'g{i // 25:04}')
+            for i in range(1, n + 1)]
+
+
+def student_objects(n):
+    return [Student(student_id=row.student_id, first_name=row.first_name,
+                    last_name=row.last_name, group_id=row.group_id)
+            for row in student_rows(n)]
+
+
+def course_objects():
+    return [Course(course_name=name, description=description)
+            for name, description in gen_courses()]
+
+
+def compile_query(query):
+    return str(query.statement.compile(dialect=postgresql.dialect()))
+
+
+def render_context(rows):
+    return {'form': 'search', 'match': 'exact', 'search_results': rows,
+            'pager': {'page_size': len(rows), 'total': None,
+                      'prev_url': None, 'next_url': '/students/search?x=1'}}
+
+
+def benchmarks():
+    """Return dict name -> callable. Inputs are built once here"""
+
+    rows = student_rows(ROWS)
+    objects = student_objects(ROWS)
+    courses = course_objects()
+    dicts = [student_to_dict(row) for row in rows]
+    render_rows = student_rows(RENDER_ROWS)
+    filters = {'first_name': 'Liam', 'last_name': 'Smith', 'group_id': 'g0001'}
+    return {
+        f'student_to_dict orm x{ROWS}':
+            lambda: [student_to_dict(s) for s in objects],
+        f'student_to_dict rows x{ROWS}':
+            lambda: [student_to_dict(s) for s in rows],
+        f'course_to_dict orm x{len(courses)}':
+            lambda: [course_to_dict(c) for c in courses],
+        f'jsonify students x{ROWS}': lambda: jsonify(dicts).get_data(),
+        f'json.dumps students x{ROWS}': lambda: json.dumps(dicts),
+        'students_query build exact':
+            lambda: students_query(filters, 'exact'),
+        'students_query build+compile exact':
+            lambda: compile_query(students_query(filters, 'exact')),
+        'students_query build+compile prefix':
+            lambda: compile_query(students_query(filters, 'prefix')),
+        'students_query build+compile fuzzy':
+            lambda: compile_query(students_query(filters, 'fuzzy')),
+        'courses_query build+compile contains':
+            lambda: compile_query(courses_query({'description': 'bio'},
+                                                'contains')),
+        f'render students.html x{RENDER_ROWS}':
+            lambda: render_template('students.html',
+                                    context=render_context(render_rows)),
+        f'stream students.html x{RENDER_ROWS}':
+            lambda: ''.join(stream_template(
+                'students.html', context=render_context(render_rows))),
+    }
+
+
+def measure(func, repeat):
+    """Return per call times (seconds) of repeat calibrated samples"""
+
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(number // 2, 1)  # autorange aims at 0.2s, use at least 0.1s
+    return [t / number for t in timer.repeat(repeat, number)], number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--filter', default='')
+    parser.add_argument('--repeat', type=int, default=REPEAT)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+    results = {}
+    # Request context is needed by jsonify, url_for and flashed messages
+    with create_app().test_request_context('/students/search'):
+        for name, func in benchmarks().items():
+            if args.filter not in name:
+                continue
+            times, number = measure(func, args.repeat)
+            results[name] = {
+                'loops': number,
+                'min_us': min(times) * 1e6,
+                'median_us': statistics.median(times) * 1e6,
+                'mean_us': statistics.mean(times) * 1e6,
+                'stdev_us': statistics.stdev(times) * 1e6
+                if len(times) > 1 else 0.0,
+            }
+            stats = results[name]
+            print(f'{name:42} median {stats["median_us"]:12.1f}us '
+                  f'min {stats["min_us"]:12.1f}us '
+                  f'stdev {stats["stdev_us"]:9.1f}us')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""notify listeners about table changes for reference data cache
+
+Revision ID: 2b8f6d4a1e93
+Revises: 9a4d2b6e8c17
+Create Date: 2026-10-18 13:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b8f6d4a1e93'
+down_revision = '9a4d2b6e8c17'
+branch_labels = None
+depends_on = None
+
+# Same as in 9a4d2b6e8c17
+FOLD_EVERY = 1000
+
+
+def upgrade():
+    # NOTIFY is delivered on commit, payload is the changed table name
+    op.execute(f"""
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+    DECLARE
+        change bigint;
+    BEGIN
+        INSERT INTO table_changes (table_name) VALUES (TG_TABLE_NAME)
+        RETURNING change_id INTO change;
+        IF change % {FOLD_EVERY} = 0 THEN
+            PERFORM fold_table_changes();
+        END IF;
+        PERFORM pg_notify('table_changed', TG_TABLE_NAME);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""")
+
+
+def downgrade():
+    op.execute(f"""
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+    DECLARE
+        change bigint;
+    BEGIN
+        INSERT INTO table_changes (table_name) VALUES (TG_TABLE_NAME)
+        RETURNING change_id INTO change;
+        IF change % {FOLD_EVERY} = 0 THEN
+            PERFORM fold_table_changes();
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""")
@@ -0,0 +1,95 @@
+"""course enrollment counts maintained by triggers
+
+Revision ID: 3f9a7d1c6b24
+Revises: 5d1e7c3a8b42
+Create Date: 2026-10-18 16:50:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a7d1c6b24'
+down_revision = '5d1e7c3a8b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # No foreign key to courses: a course rename or delete reaches the
+    # counts through the cascaded students_courses changes
+    op.create_table(
+        'course_enrollment_counts',
+        sa.Column('course_name', sa.String(length=40), nullable=False),
+        sa.Column('students', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('course_name'))
+    # One upsert per statement with the net change of every course.
+    # Rows are locked in course_name order so concurrent statements
+    # touching several courses can't deadlock. Rows of courses without
+    # students are removed
+    op.execute("""
+    CREATE OR REPLACE FUNCTION count_enrollments() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO course_enrollment_counts AS c (course_name, students)
+            SELECT course_name, count(*) FROM new_rows
+            GROUP BY course_name ORDER BY course_name
+            ON CONFLICT (course_name)
+            DO UPDATE SET students = c.students + EXCLUDED.students;
+            RETURN NULL;
+        ELSIF TG_OP = 'DELETE' THEN
+            INSERT INTO course_enrollment_counts AS c (course_name, students)
+            SELECT course_name, -count(*) FROM old_rows
+            GROUP BY course_name ORDER BY course_name
+            ON CONFLICT (course_name)
+            DO UPDATE SET students = c.students + EXCLUDED.students;
+        ELSE
+            INSERT INTO course_enrollment_counts AS c (course_name, students)
+            SELECT course_name, sum(delta) FROM (
+                SELECT course_name, 1 AS delta FROM new_rows
+                UNION ALL
+                SELECT course_name, -1 FROM old_rows) changes
+            GROUP BY course_name HAVING sum(delta) <> 0
+            ORDER BY course_name
+            ON CONFLICT (course_name)
+            DO UPDATE SET students = c.students + EXCLUDED.students;
+        END IF;
+        DELETE FROM course_enrollment_counts WHERE students <= 0;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""")
+    op.execute("""
+    CREATE OR REPLACE FUNCTION reset_enrollment_counts() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM course_enrollment_counts;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""")
+    # Writers wait until the counts are filled and the triggers are on
+    op.execute('LOCK TABLE students_courses IN SHARE MODE')
+    for event, tables in (('INSERT', 'NEW TABLE AS new_rows'),
+                          ('UPDATE', 'OLD TABLE AS old_rows '
+                                     'NEW TABLE AS new_rows'),
+                          ('DELETE', 'OLD TABLE AS old_rows')):
+        op.execute(f"""
+        CREATE TRIGGER students_courses_count_{event.lower()}
+        AFTER {event} ON students_courses REFERENCING {tables}
+        FOR EACH STATEMENT EXECUTE FUNCTION count_enrollments()""")
+    op.execute("""
+    CREATE TRIGGER students_courses_count_truncate
+    AFTER TRUNCATE ON students_courses
+    FOR EACH STATEMENT EXECUTE FUNCTION reset_enrollment_counts()""")
+    op.execute("""
+    INSERT INTO course_enrollment_counts (course_name, students)
+    SELECT course_name, count(*) FROM students_courses
+    GROUP BY course_name""")
+
+
+def downgrade():
+    for event in ('insert', 'update', 'delete', 'truncate'):
+        op.execute(f'DROP TRIGGER students_courses_count_{event} '
+                   f'ON students_courses')
+    op.execute('DROP FUNCTION reset_enrollment_counts()')
+    op.execute('DROP FUNCTION count_enrollments()')
+    op.drop_table('course_enrollment_counts')
@@ -0,0 +1,48 @@
+"""add indexes for search filters and enrollment lookups
+
+Revision ID: 4c2f9e1a7d3b
+Revises: bb968238afbb
+Create Date: 2026-10-18 12:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c2f9e1a7d3b'
+down_revision = 'bb968238afbb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_students_last_name_first_name', 'students',
+                    ['last_name', 'first_name', 'student_id'],
+                    unique=False, postgresql_include=['group_id'])
+    op.create_index('ix_students_first_name', 'students',
+                    ['first_name', 'student_id'],
+                    unique=False, postgresql_include=['last_name', 'group_id'])
+    op.create_index('ix_students_group_id', 'students',
+                    ['group_id', 'student_id'],
+                    unique=False, postgresql_include=['first_name', 'last_name'])
+    op.create_index(op.f('ix_courses_description'), 'courses',
+                    ['description'], unique=False)
+    # students_courses is created by generate_data outside of migrations
+    if sa.inspect(op.get_bind()).has_table('students_courses'):
+        op.create_index('ix_students_courses_course_name', 'students_courses',
+                        ['course_name', 'student_id'], unique=False)
+        op.create_index('ix_students_courses_student_id', 'students_courses',
+                        ['student_id'], unique=False)
+
+
+def downgrade():
+    if sa.inspect(op.get_bind()).has_table('students_courses'):
+        op.drop_index('ix_students_courses_student_id',
+                      table_name='students_courses')
+        op.drop_index('ix_students_courses_course_name',
+                      table_name='students_courses')
+    op.drop_index(op.f('ix_courses_description'), table_name='courses')
+    op.drop_index('ix_students_group_id', table_name='students')
+    op.drop_index('ix_students_first_name', table_name='students')
+    op.drop_index('ix_students_last_name_first_name', table_name='students')
@@ -0,0 +1,104 @@
+"""students_courses as association table with composite primary key
+
+Revision ID: 5d1e7c3a8b42
+Revises: 2b8f6d4a1e93
+Create Date: 2026-10-18 15:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1e7c3a8b42'
+down_revision = '2b8f6d4a1e93'
+branch_labels = None
+depends_on = None
+
+# Students copied by one INSERT ... SELECT of the data migration
+BATCH_SIZE = 50000
+
+
+def create_enrollments_table(name):
+    op.create_table(
+        name,
+        sa.Column('student_id', sa.Integer(), nullable=False),
+        sa.Column('course_name', sa.String(length=40), nullable=False),
+        sa.ForeignKeyConstraint(['student_id'], ['students.student_id'],
+                                name='students_courses_student_id_fkey',
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['course_name'], ['courses.course_name'],
+                                name='students_courses_course_name_fkey',
+                                onupdate='CASCADE', ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('student_id', 'course_name',
+                                name='students_courses_pkey'))
+
+
+def copy_enrollments(conn, source, target):
+    """Copy distinct (student_id, course_name) pairs of source to target
+    by ranges of BATCH_SIZE student ids, so every statement sorts and
+    deduplicates a bounded number of rows
+    """
+
+    low, high = conn.execute(sa.text(
+        f'SELECT min(student_id), max(student_id) FROM {source}')).one()
+    if low is None:
+        return
+    for start in range(low, high + 1, BATCH_SIZE):
+        conn.execute(sa.text(f"""
+            INSERT INTO {target} (student_id, course_name)
+            SELECT DISTINCT student_id, course_name FROM {source}
+            WHERE student_id >= :start AND student_id < :stop
+              AND course_name IS NOT NULL
+            ON CONFLICT DO NOTHING"""),
+            {'start': start, 'stop': start + BATCH_SIZE})
+
+
+def upgrade():
+    conn = op.get_bind()
+    # Before this revision generate_data created students_courses
+    # with copies of student names, no primary key and duplicates
+    if not sa.inspect(conn).has_table('students_courses'):
+        create_enrollments_table('students_courses')
+    else:
+        # Writers wait until the new table replaces the old one, readers
+        # keep reading the old one
+        op.execute('LOCK TABLE students_courses IN SHARE MODE')
+        create_enrollments_table('students_courses_new')
+        copy_enrollments(conn, 'students_courses', 'students_courses_new')
+        op.drop_table('students_courses')
+        op.rename_table('students_courses_new', 'students_courses')
+    # Primary key serves lookups by student, this one serves by course
+    op.create_index('ix_students_courses_course_name', 'students_courses',
+                    ['course_name', 'student_id'], unique=False)
+    op.execute('ANALYZE students_courses')
+
+
+def downgrade():
+    conn = op.get_bind()
+    op.rename_table('students_courses', 'students_courses_old')
+    op.execute('ALTER INDEX ix_students_courses_course_name '
+               'RENAME TO ix_students_courses_old_course_name')
+    op.execute('ALTER TABLE students_courses_old '
+               'RENAME CONSTRAINT students_courses_pkey '
+               'TO students_courses_old_pkey')
+    op.execute("""
+    CREATE TABLE students_courses (
+        student_id integer REFERENCES students (student_id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+        first_name VARCHAR(40),
+        last_name VARCHAR(40),
+        course_name VARCHAR(40) REFERENCES courses (course_name)
+        ON UPDATE CASCADE ON DELETE CASCADE
+    )""")
+    conn.execute(sa.text("""
+        INSERT INTO students_courses (student_id, first_name, last_name,
+                                      course_name)
+        SELECT e.student_id, s.first_name, s.last_name, e.course_name
+        FROM students_courses_old e
+        JOIN students s ON s.student_id = e.student_id"""))
+    op.drop_table('students_courses_old')
+    op.create_index('ix_students_courses_course_name', 'students_courses',
+                    ['course_name', 'student_id'], unique=False)
+    op.create_index('ix_students_courses_student_id', 'students_courses',
+                    ['student_id'], unique=False)
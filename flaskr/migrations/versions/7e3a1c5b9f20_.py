@@ -0,0 +1,39 @@
+"""add pg_trgm indexes for fuzzy search on names and courses
+
+Revision ID: 7e3a1c5b9f20
+Revises: 4c2f9e1a7d3b
+Create Date: 2026-10-18 12:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e3a1c5b9f20'
+down_revision = '4c2f9e1a7d3b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_students_first_name_trgm', 'students', ['first_name'],
+                    unique=False, postgresql_using='gin',
+                    postgresql_ops={'first_name': 'gin_trgm_ops'})
+    op.create_index('ix_students_last_name_trgm', 'students', ['last_name'],
+                    unique=False, postgresql_using='gin',
+                    postgresql_ops={'last_name': 'gin_trgm_ops'})
+    op.create_index('ix_courses_course_name_trgm', 'courses', ['course_name'],
+                    unique=False, postgresql_using='gin',
+                    postgresql_ops={'course_name': 'gin_trgm_ops'})
+    op.create_index('ix_courses_description_trgm', 'courses', ['description'],
+                    unique=False, postgresql_using='gin',
+                    postgresql_ops={'description': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_courses_description_trgm', table_name='courses')
+    op.drop_index('ix_courses_course_name_trgm', table_name='courses')
+    op.drop_index('ix_students_last_name_trgm', table_name='students')
+    op.drop_index('ix_students_first_name_trgm', table_name='students')
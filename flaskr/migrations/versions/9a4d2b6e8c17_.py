@@ -0,0 +1,128 @@
+"""add table and row versions for conditional GETs
+
+Revision ID: 9a4d2b6e8c17
+Revises: 7e3a1c5b9f20
+Create Date: 2026-10-18 13:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4d2b6e8c17'
+down_revision = '7e3a1c5b9f20'
+branch_labels = None
+depends_on = None
+
+VERSIONED_TABLES = ['students', 'courses', 'groups']
+ROW_VERSIONED_TABLES = ['students', 'courses']
+# Every FOLD_EVERY-th change folds logged changes into table_versions
+FOLD_EVERY = 1000
+
+
+def upgrade():
+    op.create_table('table_versions',
+    sa.Column('table_name', sa.String(length=40), nullable=False),
+    sa.Column('version', sa.BigInteger(), server_default='0', nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True),
+              server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    op.bulk_insert(sa.table('table_versions', sa.column('table_name')),
+                   [{'table_name': table} for table in VERSIONED_TABLES])
+    # Insert-only log of changes. Writers only add rows here, so they
+    # never wait for each other as they would on a shared counter row
+    op.create_table('table_changes',
+    sa.Column('change_id', sa.BigInteger(), sa.Identity(), nullable=False),
+    sa.Column('table_name', sa.String(length=40), nullable=False),
+    sa.Column('changed_at', sa.DateTime(timezone=True),
+              server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('change_id')
+    )
+    op.create_index('ix_table_changes_table_name', 'table_changes',
+                    ['table_name', 'changed_at'], unique=False)
+    # Version is the number of committed changes: folded ones plus logged
+    # ones. A count, unlike the highest change_id, also grows when changes
+    # commit out of order
+    op.execute("""
+    CREATE FUNCTION table_version(name text, OUT version bigint,
+                                  OUT updated_at timestamptz) AS $$
+        SELECT coalesce(v.version, 0) + changes.count,
+               greatest(v.updated_at, changes.changed_at)
+        FROM (SELECT count(*), max(changed_at) AS changed_at
+              FROM table_changes WHERE table_name = name) changes
+        LEFT JOIN table_versions v ON v.table_name = name
+    $$ LANGUAGE sql STABLE""")
+    # Moves logged changes into table_versions counters. Only one
+    # transaction folds at a time, the others skip folding
+    op.execute("""
+    CREATE FUNCTION fold_table_changes() RETURNS void AS $$
+    BEGIN
+        IF NOT pg_try_advisory_xact_lock(hashtext('fold_table_changes')) THEN
+            RETURN;
+        END IF;
+        WITH folded AS (
+            DELETE FROM table_changes RETURNING table_name, changed_at)
+        INSERT INTO table_versions AS v (table_name, version, updated_at)
+        SELECT table_name, count(*), max(changed_at) FROM folded
+        GROUP BY table_name
+        ON CONFLICT (table_name) DO UPDATE
+        SET version = v.version + EXCLUDED.version,
+            updated_at = greatest(v.updated_at, EXCLUDED.updated_at);
+    END
+    $$ LANGUAGE plpgsql""")
+    # Statement level trigger: one change per INSERT/UPDATE/DELETE/COPY
+    op.execute(f"""
+    CREATE FUNCTION bump_table_version() RETURNS trigger AS $$
+    DECLARE
+        change bigint;
+    BEGIN
+        INSERT INTO table_changes (table_name) VALUES (TG_TABLE_NAME)
+        RETURNING change_id INTO change;
+        IF change % {FOLD_EVERY} = 0 THEN
+            PERFORM fold_table_changes();
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""")
+    # Row versions are taken from one sequence, so a deleted and re-created
+    # row never gets the version it had before
+    op.execute('CREATE SEQUENCE row_versions')
+    op.execute("""
+    CREATE FUNCTION bump_row_version() RETURNS trigger AS $$
+    BEGIN
+        NEW.version := nextval('row_versions');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""")
+    for table in VERSIONED_TABLES:
+        op.execute(f"""
+        CREATE TRIGGER {table}_bump_table_version
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()""")
+    for table in ROW_VERSIONED_TABLES:
+        op.add_column(table, sa.Column(
+            'version', sa.BigInteger(),
+            server_default=sa.text("nextval('row_versions')"),
+            nullable=False))
+        op.execute(f"""
+        CREATE TRIGGER {table}_bump_row_version
+        BEFORE UPDATE ON {table}
+        FOR EACH ROW EXECUTE FUNCTION bump_row_version()""")
+
+
+def downgrade():
+    for table in ROW_VERSIONED_TABLES:
+        op.execute(f'DROP TRIGGER {table}_bump_row_version ON {table}')
+        op.drop_column(table, 'version')
+    for table in VERSIONED_TABLES:
+        op.execute(f'DROP TRIGGER {table}_bump_table_version ON {table}')
+    op.execute('DROP FUNCTION bump_row_version()')
+    op.execute('DROP SEQUENCE row_versions')
+    op.execute('DROP FUNCTION bump_table_version()')
+    op.execute('DROP FUNCTION fold_table_changes()')
+    op.execute('DROP FUNCTION table_version(text)')
+    op.drop_index('ix_table_changes_table_name', table_name='table_changes')
+    op.drop_table('table_changes')
+    op.drop_table('table_versions')
@@ -0,0 +1,173 @@
+"""Routing of read-only requests to read replicas.
+GET and HEAD requests read from one replica picked per request (round
+robin over replicas whose replication lag is at most max_lag seconds).
+Everything else goes to the primary:
+    - other methods and ORM flushes
+    - reads of a client for max_lag seconds after its own write, the
+      deadline is kept in the signed session cookie (read-your-writes)
+    - blocks wrapped in primary_only(), e.g. loads of the reference
+      cache which must not cache data older than the NOTIFY it got
+If no replica is configured or none is fresh enough, the primary is used.
+
+    Classes:
+        ReplicaSet:
+            Replica engines with cached lag checks
+        RoutingSession:
+            Flask-SQLAlchemy session choosing primary or replica per query
+        RoutingSQLAlchemy:
+            Flask-SQLAlchemy extension creating RoutingSession sessions
+"""
+
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request, session, current_app, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, orm, text
+from session_events import listen_once
+
+
+# Zero when all received WAL is replayed, an idle replica is not lagging
+LAG_QUERY = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM
+                      now() - pg_last_xact_replay_timestamp()), 0)
+    END""")
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+class ReplicaSet:
+    """Replica engines created on first use. setup is called with every
+    new engine, e.g. to register event hooks
+    """
+
+    def __init__(self, urls, engine_options, max_lag=5, check_interval=1,
+                 setup=None):
+        self.urls = list(urls)
+        self.engine_options = engine_options
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.setup = setup
+        self._engines = {}
+        self._lags = {}
+        self._lock = threading.Lock()
+        self._next = itertools.count()
+
+    def engine(self, url):
+        with self._lock:
+            if url not in self._engines:
+                engine = create_engine(url, **self.engine_options)
+                if self.setup:
+                    self.setup(engine)
+                self._engines[url] = engine
+            return self._engines[url]
+
+    def lag(self, url):
+        """Return replication lag of replica in seconds, cached for
+        check_interval. None if the replica can't be reached
+        """
+
+        lag, checked = self._lags.get(url, (None, 0))
+        now = time.monotonic()
+        if now - checked < self.check_interval:
+            return lag
+        try:
+            with self.engine(url).connect() as conn:
+                lag = float(conn.execution_options(metrics_ignore=True)
+                            .execute(LAG_QUERY).scalar())
+        except Exception:
+            current_app.logger.exception('Lag check of a replica failed')
+            lag = None
+        self._lags[url] = (lag, now)
+        return lag
+
+    def choose(self):
+        """Return engine of the next fresh enough replica or None"""
+
+        start = next(self._next)
+        for i in range(len(self.urls)):
+            url = self.urls[(start + i) % len(self.urls)]
+            lag = self.lag(url)
+            if lag is not None and lag <= self.max_lag:
+                return self.engine(url)
+        return None
+
+    def dispose(self):
+        for engine in self._engines.values():
+            engine.dispose()
+
+
+@contextmanager
+def primary_only():
+    """Send all queries of the block to the primary"""
+
+    previous = g.get('db_primary_only', False)
+    g.db_primary_only = True
+    try:
+        yield
+    finally:
+        g.db_primary_only = previous
+
+
+def replica_engine():
+    """Return replica engine for the current request or None if the
+    request must use the primary. The replica is chosen once per request
+    so all its reads see the same snapshot source
+    """
+
+    if not has_request_context() or request.method not in READ_METHODS:
+        return None
+    if g.get('db_primary_only'):
+        return None
+    replicas = current_app.extensions.get('replicas')
+    if replicas is None:
+        return None
+    if 'db_replica' not in g:
+        recent_write = session.get('primary_until', 0) > time.time()
+        g.db_replica = None if recent_write else replicas.choose()
+    return g.db_replica
+
+
+class RoutingSession(SignallingSession):
+    """Session reading from replica_engine() when it's allowed"""
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing:
+            engine = replica_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def wrote(*args):
+    if has_request_context():
+        g.db_wrote = True
+
+
+def wrote_statement(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or \
+            orm_execute_state.is_delete:
+        wrote()
+
+
+def init_replicas(app, db, replicas):
+    """Route reads of app to replicas and remember writes of clients"""
+
+    app.extensions['replicas'] = replicas
+    listen_once(db.session, (('after_flush', wrote),
+                             ('do_orm_execute', wrote_statement)))
+
+    @app.after_request
+    def remember_write(response):
+        if g.get('db_wrote'):
+            session['primary_until'] = time.time() + replicas.max_lag
+        return response
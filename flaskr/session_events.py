@@ -0,0 +1,21 @@
+"""Registration of session event listeners of the modules hooking into
+the app session (cache, metrics, replicas). create_app runs once per
+app, but every app shares the scoped session of the db extension, so
+listeners must not be stacked up by each of them.
+
+    Functions:
+        listen_once:
+            Register session listeners unless they already are
+"""
+
+from sqlalchemy import event
+
+
+def listen_once(session, listeners):
+    """Register (event name, listener) pairs on session. Listeners are
+    registered only once per session factory however many apps use it
+    """
+
+    for name, listener in listeners:
+        if not event.contains(session, name, listener):
+            event.listen(session, name, listener)
@@ -0,0 +1,58 @@
+"""Fixtures of tests which run against the database of TEST_DATABASE_URL.
+Tests write, delete and truncate rows, so it must be a database of its
+own whose name contains "test", never the one of DATABASE_URL. Tests
+which need it are skipped when it isn't set or can't be reached
+"""
+
+import os
+import sys
+import pytest
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+# Modules of the app import each other as top level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+# Modules of the app read these when imported, before any fixture runs
+os.environ.pop('DATABASE_REPLICA_URLS', None)
+if TEST_DATABASE_URL:
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+    os.environ['DATABASE_DIRECT_URL'] = TEST_DATABASE_URL
+else:
+    # Nothing may reach the default database through an app default
+    os.environ['DATABASE_URL'] = os.environ['DATABASE_DIRECT_URL'] = \
+        'postgresql://localhost/unset_test_database_url'
+
+from app import create_app, db  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def database_url():
+    """URL of the test database, checked not to be a dev database"""
+
+    if not TEST_DATABASE_URL:
+        pytest.skip('TEST_DATABASE_URL is not set')
+    name = make_url(TEST_DATABASE_URL).database or ''
+    if 'test' not in name:
+        pytest.skip(f'TEST_DATABASE_URL database {name!r} is not named '
+                    f'as a test database')
+    return TEST_DATABASE_URL
+
+
+@pytest.fixture(scope='session')
+def app(database_url):
+    app = create_app({'TESTING': True})
+    with app.app_context():
+        try:
+            db.session.execute(text('SELECT 1'))
+        except Exception as e:
+            pytest.skip(f'database is not reachable: {e}')
+        finally:
+            db.session.remove()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,232 @@
+import json
+import pytest
+from sqlalchemy import text
+from app import db, Student, Course, StudentCourse
+
+
+@pytest.fixture
+def course_with_students(app):
+    """Course with three enrolled students, removed afterwards"""
+
+    with app.app_context():
+        course = Course('Test course', 'Enrollment tests')
+        students = [Student('test-group', 'Test', f'Student{i}')
+                    for i in range(3)]
+        db.session.add(course)
+        db.session.add_all(students)
+        db.session.flush()
+        db.session.add_all(StudentCourse(student.student_id, course.course_name)
+                           for student in students)
+        db.session.commit()
+        student_ids = [student.student_id for student in students]
+    yield 'Test course', student_ids
+    with app.app_context():
+        Student.query.filter(Student.student_id.in_(student_ids))\
+            .delete(synchronize_session=False)
+        Course.query.filter_by(course_name='Test course').delete()
+        db.session.commit()
+
+
+def next_link(resp):
+    return resp.headers['Link'].split('<')[1].split('>')[0]
+
+
+@pytest.mark.parametrize('key', ['course_name', 'api_version', 'limit'])
+def test_next_link_ignores_query_keys_named_like_route_params(
+        client, course_with_students, key):
+    course_name, student_ids = course_with_students
+    resp = client.get(f'/api/v1/courses/{course_name}/students/'
+                      f'?limit=2&{key}=x')
+    assert resp.status_code == 200
+    assert [s['student_id'] for s in json.loads(resp.data)] == student_ids[:2]
+    resp = client.get(next_link(resp))
+    assert resp.status_code == 200
+    assert [s['student_id'] for s in json.loads(resp.data)] == student_ids[2:]
+
+
+def test_group_sizes_etag_changes_with_students(app, client):
+    resp = client.get('/api/v1/groups/sizes/?min_size=1')
+    etag = resp.headers['ETag']
+    with app.app_context():
+        student = Student('test-sizes', 'Test', 'Sizes')
+        db.session.add(student)
+        db.session.commit()
+        student_id = student.student_id
+    try:
+        resp = client.get('/api/v1/groups/sizes/?min_size=1',
+                          headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        assert {'group_id': 'test-sizes', 'students': 1} \
+            in json.loads(resp.data)
+    finally:
+        with app.app_context():
+            Student.query.filter_by(student_id=student_id).delete()
+            db.session.commit()
+
+
+def test_pgbouncer_timeouts_are_not_counted_as_queries(app):
+    from app import create_app
+    from metrics import count_queries
+    app = create_app({'TESTING': True, 'PGBOUNCER': True,
+                      'DB_STATEMENT_TIMEOUT': 5000})
+    with app.app_context():
+        with count_queries() as stats:
+            timeout = db.session.execute(
+                text('SHOW statement_timeout')).scalar()
+        db.session.remove()
+    assert timeout == '5s'
+    assert stats.queries == 1
+
+
+def test_bulk_insert_returns_ids_in_input_order(app, client, monkeypatch):
+    import api
+    monkeypatch.setattr(api, 'INSERT_CHUNK_SIZE', 3)
+    students = [{'group_id': 'test-bulk', 'first_name': 'Test',
+                 'last_name': f'Bulk{i}'} for i in range(7)]
+    resp = client.post('/api/v1/students/', json=students)
+    student_ids = json.loads(resp.data)['student_ids']
+    try:
+        assert resp.status_code == 201
+        with app.app_context():
+            names = dict(db.session.query(Student.student_id,
+                                          Student.last_name)
+                         .filter(Student.student_id.in_(student_ids)))
+        assert [names[i] for i in student_ids] == \
+            [student['last_name'] for student in students]
+    finally:
+        with app.app_context():
+            Student.query.filter(Student.student_id.in_(student_ids))\
+                .delete(synchronize_session=False)
+            db.session.commit()
+
+
+@pytest.mark.parametrize('accept, streamed', [
+    ('application/x-ndjson', True),
+    ('application/json, application/x-ndjson;q=0.5', False),
+    ('application/x-ndjson, application/json;q=0.1', True),
+    ('*/*', False),
+])
+def test_stream_requested_by_accept_media_type(accept, streamed):
+    from werkzeug.datastructures import MIMEAccept
+    from werkzeug.http import parse_accept_header
+    from api import stream_requested
+
+    assert stream_requested({}, parse_accept_header(accept, MIMEAccept)) \
+        is streamed
+
+
+def test_stream_db_error_is_not_a_truncated_200(client, monkeypatch):
+    import api
+
+    # Selecting a missing column fails when the cursor is opened
+    monkeypatch.setattr(api, 'STUDENT_COLUMNS', (text('missing_column'),))
+    client.application.testing = False
+    try:
+        resp = client.get('/api/v1/students/?stream=1')
+    finally:
+        client.application.testing = True
+    assert resp.status_code == 500
+
+
+def test_unchanged_row_is_answered_without_loading_it(app, client,
+                                                       course_with_students):
+    from metrics import count_queries
+    _, student_ids = course_with_students
+    with app.app_context():
+        db.session.add(Course('Test Version', 'Conditional GET tests'))
+        db.session.commit()
+    try:
+        for url in (f'/api/v1/students/{student_ids[0]}/',
+                    '/api/v1/courses/test version/'):
+            etag = client.get(url).headers['ETag']
+            with count_queries() as stats:
+                resp = client.get(url, headers={'If-None-Match': etag})
+            assert resp.status_code == 304
+            # One lookup of the row and table versions
+            assert stats.queries == 1
+    finally:
+        with app.app_context():
+            Course.query.filter_by(course_name='Test Version').delete()
+            db.session.commit()
+
+
+def test_concurrent_writers_do_not_wait_on_table_version(app):
+    def groups_version():
+        with engine.connect() as conn:
+            return conn.execute(text(
+                "SELECT version FROM table_version('groups')")).scalar()
+
+    with app.app_context():
+        engine = db.engine
+    version = groups_version()
+    first, second = engine.connect(), engine.connect()
+    first_tx, second_tx = first.begin(), second.begin()
+    try:
+        # The second insert would time out waiting for a counter row lock
+        for conn in (first, second):
+            conn.execute(text("SET LOCAL lock_timeout = '1s'"))
+            conn.execute(text("INSERT INTO groups (group_name) "
+                              "VALUES ('test-version-' || pg_backend_pid())"))
+        # Changes committed out of their order still change the version
+        second_tx.commit()
+        assert groups_version() == version + 1
+        first_tx.commit()
+        assert groups_version() == version + 2
+    finally:
+        for conn in (first, second):
+            conn.close()
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM groups "
+                              "WHERE group_name LIKE 'test-version-%'"))
+
+
+def test_duplicate_course_is_checked_in_db(app, client, monkeypatch):
+    import api
+    # Cache which missed a course added just now
+    monkeypatch.setattr(api, 'cached_course', lambda *args, **kwargs: None)
+    try:
+        for _ in range(2):
+            resp = client.post('/api/v1/courses/Test Duplicate/',
+                               json={'description': 'Duplicate tests'})
+        assert resp.status_code == 400
+        assert json.loads(resp.data) == {'message': 'Course is already exists'}
+    finally:
+        with app.app_context():
+            Course.query.filter_by(course_name='Test Duplicate').delete()
+            db.session.commit()
+
+
+def test_course_enrollments_is_one_query(app, client):
+    from metrics import count_queries
+    with app.app_context():
+        db.session.add(Course('Test Empty', 'Enrollment count tests'))
+        db.session.commit()
+    try:
+        with count_queries() as stats:
+            empty = client.get('/api/v1/enrollments/Test Empty/')
+            missing = client.get('/api/v1/enrollments/Test Missing/')
+        assert empty.status_code == 200
+        assert json.loads(empty.data) == {'course_name': 'Test Empty',
+                                          'students': 0}
+        assert missing.status_code == 404
+        assert stats.queries == 2
+    finally:
+        with app.app_context():
+            Course.query.filter_by(course_name='Test Empty').delete()
+            db.session.commit()
+
+
+def test_enrollment_item_routes_return_one_enrollment(client,
+                                                      course_with_students):
+    course_name, student_ids = course_with_students
+    for url in (f'/api/v1/students/{student_ids[0]}/courses/{course_name}/',
+                f'/api/v1/courses/{course_name}/students/{student_ids[0]}/'):
+        resp = client.get(url)
+        assert resp.status_code == 200
+        enrollment = json.loads(resp.data)
+        assert enrollment['student_id'] == student_ids[0]
+        assert enrollment['course']['course_name'] == course_name
+    client.delete(f'/api/v1/students/{student_ids[0]}/courses/{course_name}/')
+    for url in (f'/api/v1/students/{student_ids[0]}/courses/{course_name}/',
+                f'/api/v1/courses/{course_name}/students/{student_ids[0]}/'):
+        assert client.get(url).status_code == 404
@@ -0,0 +1,129 @@
+"""Every view with a query budget keeps it when the reference cache is
+cold, both when the cache can hold the tables and when they are too big
+for it and the view falls back to the DB
+"""
+
+import pytest
+from app import create_app, db, Student, Course, Group, StudentCourse
+
+
+GROUP = 'test-budgets'
+COURSE = 'Test Budgets'
+
+CASES = [
+    ('GET', '/students/', None),
+    ('GET', '/students/add/', None),
+    ('POST', '/students/add/', {'first_name': 'Budget', 'last_name': 'New',
+                                'group_id': GROUP}),
+    ('GET', '/students/update/{student_id}', None),
+    ('POST', '/students/update/{student_id}', {'first_name': 'Budget',
+                                               'last_name': 'Updated',
+                                               'group_id': GROUP}),
+    ('GET', '/students/delete/{student_id}', None),
+    ('POST', '/students/delete/{student_id}', {}),
+    ('GET', '/courses?count=1', None),
+    ('GET', '/courses/add', None),
+    ('POST', '/courses/add', {'course_name': f'{COURSE} New',
+                              'description': 'Budget tests'}),
+    ('GET', '/courses/update/{course}', None),
+    ('POST', '/courses/update/{course}', {'course_name': COURSE,
+                                          'description': 'Updated'}),
+    ('GET', '/courses/delete/{course}', None),
+    ('POST', '/courses/delete/{course}', {}),
+    ('GET', '/groups?count=1', None),
+    ('GET', '/groups/add/', None),
+    ('POST', '/groups/add/', {'group_name': f'{GROUP}-new'}),
+    ('GET', '/groups/update/{group}', None),
+    ('POST', '/groups/update/{group}', {'group_name': GROUP}),
+    ('GET', '/groups/delete/{group}', None),
+    ('POST', '/groups/delete/{group}', {}),
+    ('GET', '/api/v1/students/', None),
+    ('GET', '/api/v1/students/{student_id}/', None),
+    ('PUT', '/api/v1/students/{student_id}/', {'first_name': 'Budget',
+                                               'last_name': 'Put',
+                                               'group_id': GROUP}),
+    ('DELETE', '/api/v1/students/{student_id}/', None),
+    ('GET', '/api/v1/courses/', None),
+    ('GET', '/api/v1/courses/{course}/', None),
+    ('PUT', '/api/v1/courses/{course}/', {'description': 'Put'}),
+    ('DELETE', '/api/v1/courses/{course}/', None),
+    ('GET', '/api/v1/students/{student_id}/courses/', None),
+    ('POST', '/api/v1/students/{student_id}/courses/',
+     {'course_names': [COURSE]}),
+    ('GET', '/api/v1/students/{student_id}/courses/{course}/', None),
+    ('DELETE', '/api/v1/students/{student_id}/courses/{course}/', None),
+    ('GET', '/api/v1/courses/{course}/students/', None),
+    ('POST', '/api/v1/courses/{course}/students/',
+     {'student_ids': ['{student_id}']}),
+    ('GET', '/api/v1/courses/{course}/students/{student_id}/', None),
+    ('DELETE', '/api/v1/courses/{course}/students/{student_id}/', None),
+    ('GET', '/api/v1/groups/sizes/', None),
+    ('GET', '/api/v1/enrollments/', None),
+    ('GET', '/api/v1/enrollments/{course}/', None),
+]
+
+
+@pytest.fixture(scope='module', params=[10_000, 1],
+                ids=['cacheable', 'too-big'])
+def budget_app(app, request):
+    return create_app({'TESTING': True,
+                       'REFERENCE_CACHE_MAX_ROWS': request.param})
+
+
+@pytest.fixture
+def rows(budget_app):
+    """Group, course and an enrolled student, removed afterwards"""
+
+    with budget_app.app_context():
+        db.session.add_all([Group(GROUP), Course(COURSE, 'Budget tests')])
+        student = Student(GROUP, 'Budget', 'Student')
+        db.session.add(student)
+        db.session.flush()
+        db.session.add(StudentCourse(student.student_id, COURSE))
+        db.session.commit()
+        ids = {'student_id': student.student_id, 'course': COURSE,
+               'group': GROUP}
+    yield ids
+    with budget_app.app_context():
+        Student.query.filter(Student.first_name == 'Budget')\
+            .delete(synchronize_session=False)
+        Course.query.filter(Course.course_name.like(f'{COURSE}%'))\
+            .delete(synchronize_session=False)
+        Group.query.filter(Group.group_name.like(f'{GROUP}%'))\
+            .delete(synchronize_session=False)
+        db.session.commit()
+
+
+def cold_cache(app):
+    """Connect the cache LISTEN thread and drop every cached table"""
+
+    cache = app.extensions['reference_cache']
+    with app.app_context():
+        cache._ensure_listener()
+    assert cache._listening.wait(5)
+    cache.invalidate()
+
+
+def fill(value, ids):
+    if isinstance(value, str):
+        value = value.format(**ids)
+        return int(value) if value.isdigit() else value
+    if isinstance(value, list):
+        return [fill(item, ids) for item in value]
+    if isinstance(value, dict):
+        return {key: fill(item, ids) for key, item in value.items()}
+    return value
+
+
+@pytest.mark.parametrize('method, url, data', CASES,
+                         ids=[f'{method} {url}' for method, url, _ in CASES])
+def test_view_keeps_query_budget_with_cold_cache(budget_app, rows, method,
+                                                  url, data):
+    cold_cache(budget_app)
+    kwargs = {}
+    if data is not None:
+        kwargs['json' if url.startswith('/api/') else 'data'] = \
+            fill(data, rows)
+    resp = budget_app.test_client().open(fill(url, rows), method=method,
+                                         **kwargs)
+    assert resp.status_code < 500
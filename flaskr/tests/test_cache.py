@@ -0,0 +1,99 @@
+import os
+from cache import ReferenceCache
+
+
+def offline_cache(versions):
+    """Cache with a fake table and no LISTEN connection"""
+
+    state = {'version': 1, 'loads': 0}
+
+    def load_courses(limit):
+        state['loads'] += 1
+        return [(name, {'course_name': name, 'version': state['version']})
+                for name in ('Bio', 'Math')]
+
+    cache = ReferenceCache('', {'courses': load_courses},
+                           versions=lambda table: state['version']
+                           if versions else None)
+    cache._listener_pid = os.getpid()
+    cache._listening.set()
+    return cache, state
+
+
+def test_entry_of_older_version_is_not_served_and_dropped():
+    cache, state = offline_cache(versions=True)
+    assert cache.page('courses', 10, version=1)[0][0]['version'] == 1
+    # Committed write whose NOTIFY didn't arrive yet
+    state['version'] = 2
+    assert cache.page('courses', 10, version=2) is None
+    assert cache.page('courses', 10, version=2)[0][0]['version'] == 2
+    assert state['loads'] == 2
+
+
+def test_entry_newer_than_requested_version_is_kept():
+    cache, state = offline_cache(versions=True)
+    state['version'] = 3
+    assert cache.get('courses', version=3) is not None
+    # E.g. the version was read from a lagging replica
+    assert cache.get('courses', version=2) is None
+    assert cache.get('courses', version=3) is not None
+    assert state['loads'] == 1
+
+
+def test_version_is_not_checked_without_versions_function():
+    cache, state = offline_cache(versions=False)
+    assert cache.get('courses') is not None
+    assert cache.get('courses', version=5) is None
+
+
+def test_derived_entry_is_checked_against_source_table_version():
+    requested = []
+    cache = ReferenceCache(
+        '', {'group_sizes': lambda limit: [('g1', {'students': 3})]},
+        sources={'group_sizes': 'students'},
+        versions=lambda table: requested.append(table) or 7)
+    cache._listener_pid = os.getpid()
+    cache._listening.set()
+    assert cache.get('group_sizes', version=7) == {'g1': {'students': 3}}
+    assert cache.get('group_sizes', version=8) is None
+    assert requested == ['students']
+
+
+
+def test_loader_reads_at_most_one_row_over_max_rows():
+    limits = []
+
+    def load_groups(limit):
+        limits.append(limit)
+        return [(i, {'group_name': i}) for i in range(limit)]
+
+    cache = ReferenceCache('', {'groups': load_groups}, max_rows=2)
+    cache._listener_pid = os.getpid()
+    cache._listening.set()
+    assert cache.get('groups') is None
+    # Too big marker is kept for ttl, the table isn't read again
+    assert cache.get('groups') is None
+    assert limits == [3]
+
+def test_session_listeners_are_registered_once_per_session_factory(app):
+    from app import create_app, db, Group
+
+    def listeners():
+        with app.app_context():
+            dispatch = db.session().dispatch
+            return len(dispatch.after_commit), len(dispatch.do_orm_execute)
+
+    counts = listeners()
+    apps = [create_app({'TESTING': True}) for _ in range(2)]
+    assert listeners() == counts
+    # A commit invalidates the cache of the app the session belongs to.
+    # Caches of these apps were never read, so they don't LISTEN
+    caches = [a.extensions['reference_cache'] for a in apps]
+    generations = [cache._generations['groups'] for cache in caches]
+    with apps[1].app_context():
+        db.session.add(Group('test-listeners'))
+        db.session.commit()
+        Group.query.filter_by(group_name='test-listeners').delete()
+        db.session.commit()
+    assert caches[0]._generations['groups'] == generations[0]
+    assert caches[1]._generations['groups'] == generations[1] + 2
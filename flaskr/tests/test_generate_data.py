@@ -0,0 +1,36 @@
+import psycopg2
+import pytest
+from generate_data import copy_rows
+
+
+@pytest.fixture
+def conn(database_url):
+    try:
+        conn = psycopg2.connect(database_url)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f'database is not reachable: {e}')
+    yield conn
+    conn.rollback()
+    conn.close()
+
+
+def test_copy_keeps_empty_strings_outside_null_columns(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('CREATE TEMP TABLE copied (id integer, name text, '
+                       'group_id text)')
+    copy_rows(conn, 'copied', ['id', 'name', 'group_id'],
+              [(1, '', None), (2, 'b', ''), (3, 'c', 'g')],
+              null_columns=['group_id'])
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT id, name, group_id FROM copied ORDER BY id')
+        assert cursor.fetchall() == [(1, '', None), (2, 'b', None),
+                                     (3, 'c', 'g')]
+
+
+def test_copy_loads_none_as_empty_string_outside_null_columns(conn):
+    with conn.cursor() as cursor:
+        cursor.execute('CREATE TEMP TABLE copied (id integer, name text)')
+    copy_rows(conn, 'copied', ['id', 'name'], [(1, None)])
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT name FROM copied')
+        assert cursor.fetchall() == [('',)]
@@ -0,0 +1,14 @@
+import pytest
+from generate_large_data import gen_groups_sizes
+
+
+@pytest.mark.parametrize('n_students', [0, 1, 9, 10, 1000, 12345])
+def test_group_sizes_sum_up_to_students(n_students):
+    sizes = gen_groups_sizes(n_students, seed=1)
+    assert sizes.sum() == n_students
+    assert (sizes[:-1] >= 10).all() and (sizes <= 30).all()
+
+
+def test_negative_students_are_rejected():
+    with pytest.raises(ValueError):
+        gen_groups_sizes(-1, seed=1)
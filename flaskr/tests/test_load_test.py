@@ -0,0 +1,13 @@
+import pytest
+from load_test import percentile
+
+
+@pytest.mark.parametrize('n, q, expected', [
+    (100, 95, 95), (100, 99, 99), (100, 50, 50), (100, 100, 100),
+    (100, 0, 1), (10, 95, 10), (3, 50, 2), (1, 99, 1)])
+def test_percentile_is_nearest_rank(n, q, expected):
+    assert percentile(list(range(1, n + 1)), q) == expected
+
+
+def test_percentile_of_no_values():
+    assert percentile([], 95) is None
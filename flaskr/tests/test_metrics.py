@@ -0,0 +1,65 @@
+import pytest
+from flask import jsonify
+from sqlalchemy import text
+from app import create_app, db, Group
+from metrics import count_queries, query_budget, QueryBudgetExceeded
+
+
+@pytest.fixture(scope='module')
+def budget_app(app):
+    """App with views running given number of statements under a budget
+    of 2
+    """
+
+    app = create_app({'TESTING': True})
+
+    @app.route('/test/budget/read/<int:queries>')
+    @query_budget(2)
+    def budget_read(queries):
+        for _ in range(queries):
+            db.session.execute(text('SELECT 1'))
+        return jsonify(queries)
+
+    @app.route('/test/budget/write/<int:queries>', methods=['POST'])
+    @query_budget(2)
+    def budget_write(queries):
+        for _ in range(queries - 1):
+            db.session.execute(text('SELECT 1'))
+        db.session.add(Group('test-budget'))
+        db.session.commit()
+        return jsonify(queries)
+
+    yield app
+    with app.app_context():
+        Group.query.filter_by(group_name='test-budget').delete()
+        db.session.commit()
+
+
+def test_count_queries_counts_statements_of_block(budget_app):
+    with count_queries() as stats:
+        budget_app.test_client().get('/test/budget/read/2')
+    assert stats.queries == 2
+
+
+def test_route_within_budget_passes(budget_app):
+    assert budget_app.test_client().get('/test/budget/read/2')\
+        .status_code == 200
+
+
+def test_route_over_budget_fails(budget_app):
+    with pytest.raises(QueryBudgetExceeded):
+        budget_app.test_client().get('/test/budget/read/3')
+
+
+def test_write_over_budget_fails_before_commit(budget_app):
+    with pytest.raises(QueryBudgetExceeded):
+        budget_app.test_client().post('/test/budget/write/3')
+    with budget_app.app_context():
+        assert db.session.get(Group, 'test-budget') is None
+
+
+def test_write_within_budget_is_committed(budget_app):
+    assert budget_app.test_client().post('/test/budget/write/2')\
+        .status_code == 200
+    with budget_app.app_context():
+        assert db.session.get(Group, 'test-budget') is not None